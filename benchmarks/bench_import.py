@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# how each entry point is loaded: the scripts only call main() when run as __main__, so this measures their imports
+ENTRY_POINTS = {
+    'backup' : "import runpy; runpy.run_path('backup', run_name='bench')",
+    'list-backups' : "import runpy; runpy.run_path('list-backups', run_name='bench')",
+    'mcbackup' : "import runpy; import mcbackup",
+}
+
+# modules an entry point must not import before it knows it needs them
+FORBIDDEN = {
+    'backup' : ['zipfile', 'tarfile', 'bz2', 'lzma', 'dateutil.parser', 'dateutil.tz', 'isoweek', 'ctypes',
+                'concurrent.futures', 'mcbackup.replication', 'mcbackup.tee', 'mcbackup.checkpoint', 'boto3'],
+    'list-backups' : ['zipfile', 'tarfile', 'bz2', 'lzma', 'dateutil', 'isoweek', 'ctypes', 'concurrent.futures',
+                      'mcbackup.policy', 'mcbackup.backup', 'boto3'],
+    'mcbackup' : ['mcbackup.backup', 'mcbackup.meta', 'mcbackup.policy', 'dateutil'],
+}
+
+_BASELINE = "import runpy"
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure and guard the import time of the command line tools.')
+
+    parser.add_argument('entry_points',
+                        metavar='ENTRY_POINT',
+                        nargs='*',
+                        help='The entry points to measure.  Default is all of {}'.format(', '.join(
+                            sorted(ENTRY_POINTS.keys()))))
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=10,
+                        help='How many fresh interpreters to measure each entry point in.  Default is 10')
+    parser.add_argument('--max-ms',
+                        dest='max_ms',
+                        type=float,
+                        help='Fail if the median import time of an entry point exceeds this many milliseconds')
+    parser.add_argument('--json',
+                        dest='json_output',
+                        metavar='FILE',
+                        help='Write the results as JSON to FILE')
+    args = parser.parse_args()
+
+    for name in args.entry_points:
+        if name not in ENTRY_POINTS:
+            parser.error("Unknown entry point {}".format(name))
+
+    failed = False
+    results = []
+    for name in args.entry_points or sorted(ENTRY_POINTS.keys()):
+        result = measure(name, args.repeat)
+        results.append(result)
+
+        print ("{:<14}{:8.1f}ms median{:8.1f}ms min  {} modules".format(name, result['median_ms'], result['min_ms'],
+                                                                         len(result['modules'])))
+        for (module, cumulative_us) in result['slowest']:
+            print ("{:>20}{:8.1f}ms  {}".format("", cumulative_us / 1000, module))
+
+        if result['forbidden']:
+            print ("{:<14}imports {}".format("", ", ".join(result['forbidden'])))
+            failed = True
+        if args.max_ms is not None and result['median_ms'] > args.max_ms:
+            print ("{:<14}exceeds {:.1f}ms".format("", args.max_ms))
+            failed = True
+
+    if args.json_output:
+        with open(args.json_output, 'w') as file:
+            json.dump({'python' : sys.version.split()[0], 'results' : results}, file, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+def measure(name, repeat):
+    baseline = set(import_times(_BASELINE).keys())
+
+    totals = []
+    for _ in range(repeat):
+        times = import_times(ENTRY_POINTS[name])
+        # only count what the entry point itself pulls in, not what every interpreter loads on startup
+        totals.append(sum(self_us for (module, (self_us, _)) in times.items() if module not in baseline))
+
+    modules = sorted(module for module in times.keys() if module not in baseline)
+    slowest = sorted(((module, times[module][1]) for module in modules if '.' not in module or
+                      module.startswith('mcbackup')), key=lambda item: -item[1])[:10]
+    return {'name' : name, 'median_ms' : statistics.median(totals) / 1000, 'min_ms' : min(totals) / 1000,
+            'modules' : modules, 'slowest' : slowest, 'forbidden' : forbidden_imports(name, modules)}
+
+def forbidden_imports(name, modules):
+    return sorted(module for module in modules for forbidden in FORBIDDEN[name]
+                  if module == forbidden or module.startswith(forbidden + '.'))
+
+def imported_modules(name):
+    return set(import_times(ENTRY_POINTS[name]).keys()) - set(import_times(_BASELINE).keys())
+
+def import_times(code):
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    # every line is "import time: <self us> | <cumulative us> | <indented module name>"
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        (self_us, cumulative_us, module) = line[len('import time:'):].split('|')
+        if self_us.strip().isdigit():
+            times[module.strip()] = (int(self_us), int(cumulative_us))
+
+    return times
+
+if __name__ == '__main__':
+    main()
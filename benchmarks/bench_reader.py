@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from mcbackup.archiver import DEFINITIONS
+from mcbackup.backup import WorldBackup
+from mcbackup.reader import PipelinedReader, SynchronousReader, resident_fraction
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the synchronous and pipelined world readers.')
+
+    parser.add_argument('-a', '--archive-format',
+                        dest='archive_format',
+                        metavar='FORMAT',
+                        choices=DEFINITIONS.keys(),
+                        default='tar|gz',
+                        help='The archive format to benchmark.  Default is tar|gz')
+    parser.add_argument('--files',
+                        type=int,
+                        default=64,
+                        help='The number of region files in the synthetic world.  Default is 64')
+    parser.add_argument('--file-size',
+                        dest='file_size',
+                        type=int,
+                        default=4,
+                        help='The size of each region file in megabytes.  Default is 4')
+    parser.add_argument('--hot-fraction',
+                        dest='hot_fraction',
+                        type=float,
+                        default=0.25,
+                        help='The fraction of region files the "server" keeps in the page cache.  Default is 0.25')
+    parser.add_argument('--json',
+                        dest='json_output',
+                        metavar='FILE',
+                        help='Write the results as JSON to FILE')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='mcbackup-bench-')
+    try:
+        world_path = create_world(work_dir, args.files, args.file_size * 1024 * 1024)
+        region_files = sorted(os.path.join(world_path, 'region', name)
+                              for name in os.listdir(os.path.join(world_path, 'region')))
+        hot_files = region_files[:int(len(region_files) * args.hot_fraction)]
+        cold_files = region_files[len(hot_files):]
+
+        results = []
+        for (name, reader) in [('synchronous', SynchronousReader()), ('pipelined', PipelinedReader())]:
+            results.append(run(name, reader, world_path, work_dir, DEFINITIONS[args.archive_format],
+                               hot_files, cold_files))
+
+        for result in results:
+            print ("{name:>12}: {wall_time:8.3f}s  hot files cached {hot_cached:6.1%}  "
+                   "cold files cached {cold_cached:6.1%}".format(**result))
+
+        if args.json_output:
+            with open(args.json_output, 'w') as file:
+                json.dump({'archive_format' : args.archive_format, 'files' : args.files,
+                           'file_size' : args.file_size, 'results' : results}, file, indent=2)
+    finally:
+        shutil.rmtree(work_dir)
+
+def run(name, reader, world_path, work_dir, archiver, hot_files, cold_files):
+    # start every run from the same cache state: cold files evicted, the server's hot files resident
+    os.sync()
+    for full_path in hot_files + cold_files:
+        drop_cache(full_path)
+    for full_path in hot_files:
+        with open(full_path, 'rb') as file:
+            while file.read(1024 * 1024):
+                pass
+
+    output_file = os.path.join(work_dir, "world-{}.{}".format(name, archiver.default_ext))
+    start = time.perf_counter()
+    WorldBackup(world_path, archiver, output_file, reader).run()
+    wall_time = time.perf_counter() - start
+    os.unlink(output_file)
+
+    return {'name' : name, 'wall_time' : wall_time,
+            'hot_cached' : average_residency(hot_files), 'cold_cached' : average_residency(cold_files)}
+
+def create_world(work_dir, files, file_size):
+    world_path = os.path.join(work_dir, 'world')
+    os.makedirs(os.path.join(world_path, 'region'))
+
+    with open(os.path.join(world_path, 'level.dat'), 'wb') as file:
+        file.write(os.urandom(4096))
+
+    # half random, half repetitive data gives the compressor realistic work to do
+    rng = random.Random(0)
+    for i in range(files):
+        with open(os.path.join(world_path, 'region', "r.{}.{}.mca".format(i % 32, i // 32)), 'wb') as file:
+            written = 0
+            while written < file_size:
+                chunk = os.urandom(2048) + bytes([rng.randrange(4)]) * 2048
+                file.write(chunk)
+                written += len(chunk)
+
+    return world_path
+
+def drop_cache(full_path):
+    with open(full_path, 'rb') as file:
+        os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def average_residency(files):
+    if not files:
+        return 1.0
+    return sum(resident_fraction(full_path) for full_path in files) / len(files)
+
+if __name__ == '__main__':
+    main()
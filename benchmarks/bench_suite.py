@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from mcbackup import meta
+from mcbackup.archiver import DEFINITIONS
+from mcbackup.backup import WorldBackup
+from mcbackup.policy import parser as policy_parser
+from benchmarks.synthetic import create_world, create_catalog
+
+DEFAULT_POLICY = ["keep 7 days", "latest weekly keep 1 month", "latest monthly keep 6 months"]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark world backups, catalogs and retention policies.')
+
+    parser.add_argument('-a', '--archive-format',
+                        dest='archive_formats',
+                        metavar='FORMAT',
+                        choices=DEFINITIONS.keys(),
+                        action='append',
+                        help='An archive format to benchmark, may be repeated.  Default is every format')
+    parser.add_argument('--regions',
+                        type=int,
+                        default=4,
+                        help='The number of region files in the synthetic world.  Default is 4')
+    parser.add_argument('--chunks',
+                        type=int,
+                        default=1024,
+                        help='The number of chunks in each region file, at most 1024.  Default is 1024')
+    parser.add_argument('--fill',
+                        type=float,
+                        default=0.5,
+                        help='The fraction of non-air sections in every chunk.  Default is 0.5')
+    parser.add_argument('--players',
+                        type=int,
+                        default=2000,
+                        help='The number of players with playerdata, stats and advancements.  Default is 2000')
+    parser.add_argument('--catalog-size',
+                        dest='catalog_sizes',
+                        metavar='COUNT',
+                        type=int,
+                        action='append',
+                        help='A number of catalog entries to benchmark, may be repeated.  Default is 1000 and 10000')
+    parser.add_argument('-r', '--retention-policy',
+                        dest='policy',
+                        default=DEFAULT_POLICY,
+                        nargs="*",
+                        help="The retention policy to benchmark")
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=3,
+                        help='How many times each benchmark is run.  Default is 3')
+    parser.add_argument('--skip-worlds',
+                        dest='skip_worlds',
+                        action='store_true',
+                        help='Only run the catalog and retention benchmarks')
+    parser.add_argument('--json',
+                        dest='json_output',
+                        metavar='FILE',
+                        help='Write the results as JSON to FILE')
+    parser.add_argument('--compare',
+                        metavar='FILE',
+                        help='Compare the results against the JSON results of an earlier run')
+    args = parser.parse_args()
+
+    results = []
+    work_dir = tempfile.mkdtemp(prefix='mcbackup-bench-')
+    try:
+        if not args.skip_worlds:
+            results.extend(bench_world_backup(work_dir, args.archive_formats or sorted(DEFINITIONS.keys()),
+                                              args.regions, args.chunks, args.fill, args.players, args.repeat))
+
+        retention_policy = policy_parser.parse(args.policy)
+        for catalog_size in args.catalog_sizes or [1000, 10000]:
+            results.extend(bench_catalog(work_dir, catalog_size, args.repeat))
+            results.extend(bench_retention(retention_policy, catalog_size, args.repeat))
+    finally:
+        shutil.rmtree(work_dir)
+
+    baseline = load_results(args.compare) if args.compare else {}
+    for result in results:
+        line = "{:<40}{:>10.4f}s median{:>10.4f}s min".format(result['name'], result['median'], result['min'])
+        if 'throughput' in result:
+            line += "{:>10.1f} MB/s".format(result['throughput'] / (1024 * 1024))
+        if result['name'] in baseline:
+            line += "{:>+9.1%} vs baseline".format(result['median'] / baseline[result['name']]['median'] - 1)
+        print (line)
+
+    if args.json_output:
+        with open(args.json_output, 'w') as file:
+            json.dump({'python' : sys.version.split()[0], 'policy' : args.policy, 'results' : results}, file,
+                      indent=2)
+
+def bench_world_backup(work_dir, archive_formats, regions, chunks, fill, players, repeat):
+    world_path = os.path.join(work_dir, 'world')
+    world_size = create_world(world_path, regions, chunks, fill, players)
+
+    results = []
+    for archive_format in archive_formats:
+        archiver = DEFINITIONS[archive_format]
+        output_file = os.path.join(work_dir, "world.{}".format(archiver.default_ext))
+
+        def run():
+            WorldBackup(world_path, archiver, output_file).run()
+
+        result = measure("world_backup[{}]".format(archive_format), run, repeat)
+        result.update({'world_bytes' : world_size, 'archive_bytes' : os.path.getsize(output_file),
+                       'throughput' : world_size / result['median']})
+        results.append(result)
+        os.unlink(output_file)
+
+    return results
+
+def bench_catalog(work_dir, catalog_size, repeat):
+    backup_dir = os.path.join(work_dir, "catalog-{}".format(catalog_size))
+    backups = create_catalog(catalog_size)
+
+    save = measure("save_meta[{}]".format(catalog_size), lambda: meta.save_meta(backup_dir, backups), repeat)
+    load = measure("load_meta[{}]".format(catalog_size), lambda: meta.load_meta(backup_dir), repeat)
+    return [save, load]
+
+def bench_retention(retention_policy, catalog_size, repeat):
+    backups = create_catalog(catalog_size)
+    now = backups[-1].time
+
+    # the first run over an unpruned history, then one new backup added to what that run kept
+    first = measure("retention_apply[{}]".format(catalog_size), lambda: retention_policy.apply(backups, now),
+                    repeat)
+
+    (kept, _) = retention_policy.apply(backups, now)
+    now += datetime.timedelta(minutes=15)
+    new_backups = [meta.BackupMeta(time=now, archive_format='tar|gz')]
+    steady = measure("retention_apply_steady[{}]".format(catalog_size),
+                     lambda: retention_policy.apply(kept + new_backups, now), repeat)
+    incremental = measure("retention_apply_incremental[{}]".format(catalog_size),
+                          lambda: retention_policy.apply_incremental(kept + new_backups, new_backups, now), repeat)
+    for result in [steady, incremental]:
+        result['entries'] = len(kept) + len(new_backups)
+
+    return [first, steady, incremental]
+
+def measure(name, function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return {'name' : name, 'times' : times, 'min' : min(times), 'median' : statistics.median(times)}
+
+def load_results(path):
+    with open(path, 'r') as file:
+        return {result['name'] : result for result in json.load(file)['results']}
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+import io
+import os
+import gzip
+import json
+import math
+import uuid
+import zlib
+import random
+import struct
+import datetime
+from dateutil.tz import tzutc
+
+from mcbackup import meta
+
+__all__ = ['create_world', 'create_catalog']
+
+DATA_VERSION = 3465
+VERSION_NAME = "1.20.1"
+
+_TAG_END = 0
+_TAG_BYTE = 1
+_TAG_SHORT = 2
+_TAG_INT = 3
+_TAG_LONG = 4
+_TAG_FLOAT = 5
+_TAG_DOUBLE = 6
+_TAG_STRING = 8
+_TAG_LIST = 9
+_TAG_COMPOUND = 10
+_TAG_LONG_ARRAY = 12
+
+_SECTOR_SIZE = 4096
+_CHUNKS_PER_REGION = 32 * 32
+_SECTIONS_PER_CHUNK = 24
+_BLOCKS_PER_SECTION = 16 * 16 * 16
+_PALETTE_SIZE = 8
+# block states are packed with at least 4 bits per block, whatever the size of the palette
+_BITS_PER_BLOCK = 4
+_COMPRESSION_ZLIB = 2
+
+_BLOCKS = ["minecraft:stone", "minecraft:deepslate", "minecraft:dirt", "minecraft:gravel", "minecraft:andesite",
+           "minecraft:granite", "minecraft:diorite", "minecraft:coal_ore", "minecraft:iron_ore", "minecraft:water",
+           "minecraft:grass_block", "minecraft:oak_log", "minecraft:oak_leaves", "minecraft:sand",
+           "minecraft:copper_ore", "minecraft:tuff"]
+_BIOMES = ["minecraft:plains", "minecraft:forest", "minecraft:river", "minecraft:dripstone_caves"]
+_ITEMS = ["minecraft:diamond_pickaxe", "minecraft:torch", "minecraft:cobblestone", "minecraft:bread",
+          "minecraft:oak_planks", "minecraft:iron_ingot"]
+
+def create_world(world_path, regions=4, chunks=_CHUNKS_PER_REGION, fill=0.5, players=1000, seed=0):
+    """Writes a world in the Anvil format: region files of chunks with the given fraction of non-air sections,
+    level.dat, and playerdata, stats and advancements files for every player.  Returns the total bytes written."""
+    if not 0 < chunks <= _CHUNKS_PER_REGION:
+        raise ValueError("A region holds between 1 and {} chunks".format(_CHUNKS_PER_REGION))
+
+    if not 0 <= fill <= 1:
+        raise ValueError("The fill level must be between 0 and 1")
+
+    rng = random.Random(seed)
+    for directory in ["region", "playerdata", "stats", "advancements"]:
+        os.makedirs(os.path.join(world_path, directory), exist_ok=True)
+
+    written = _write_file(os.path.join(world_path, "level.dat"), gzip.compress(_level_dat(rng)))
+
+    # regions are laid out in a square around the spawn, like a world explored outwards from it
+    side = int(math.ceil(math.sqrt(regions)))
+    for i in range(regions):
+        (region_x, region_z) = (i % side - side // 2, i // side - side // 2)
+        region_file = os.path.join(world_path, "region", "r.{}.{}.mca".format(region_x, region_z))
+        written += _write_file(region_file, _region(rng, region_x, region_z, chunks, fill))
+
+    for _ in range(players):
+        player = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        written += _write_file(os.path.join(world_path, "playerdata", player + ".dat"),
+                               gzip.compress(_player_dat(rng)))
+        written += _write_file(os.path.join(world_path, "stats", player + ".json"), _stats_json(rng))
+        written += _write_file(os.path.join(world_path, "advancements", player + ".json"), _advancements_json(rng))
+
+    return written
+
+def create_catalog(count, worlds=("world", "world_nether", "world_the_end"), interval=datetime.timedelta(minutes=15),
+                   end=datetime.datetime(2024, 1, 1, tzinfo=tzutc())):
+    """Returns count snapshot backups of worlds, one every interval up to end, oldest first."""
+    backups = []
+    for i in range(count):
+        time = end - interval * (count - 1 - i)
+        backup_id = str(uuid.UUID(int=i, version=4))
+        backups.append(meta.BackupMeta(backup_id, time, 'tar|gz', [
+            meta.WorldMeta(world, "{:%Y%m%d}/{}-{:%H%M%S}.tar.gz".format(time, world, time)) for world in worlds]))
+
+    return backups
+
+def _write_file(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+    return len(data)
+
+def _region(rng, region_x, region_z, chunks, fill):
+    # an 8KiB header of chunk locations and timestamps, then every chunk padded to whole 4KiB sectors
+    locations = bytearray(_SECTOR_SIZE)
+    timestamps = bytearray(_SECTOR_SIZE)
+    body = io.BytesIO()
+    sector = 2
+
+    patterns = _section_patterns(rng)
+    for index in sorted(rng.sample(range(_CHUNKS_PER_REGION), chunks)):
+        (chunk_x, chunk_z) = (region_x * 32 + index % 32, region_z * 32 + index // 32)
+        data = zlib.compress(_chunk(rng, patterns, chunk_x, chunk_z, fill))
+
+        payload = struct.pack('>ib', len(data) + 1, _COMPRESSION_ZLIB) + data
+        sectors = (len(payload) + _SECTOR_SIZE - 1) // _SECTOR_SIZE
+        body.write(payload + bytes(sectors * _SECTOR_SIZE - len(payload)))
+
+        struct.pack_into('>I', locations, index * 4, (sector << 8) | sectors)
+        struct.pack_into('>I', timestamps, index * 4, 1700000000 + rng.randrange(10000000))
+        sector += sectors
+
+    return bytes(locations) + bytes(timestamps) + body.getvalue()
+
+def _section_patterns(rng):
+    # sections are assembled from a small pool of packed longs, which compresses about as well as real terrain
+    # without generating every block.  Every packed index points into the palette, or the game rejects the chunk
+    patterns = []
+    for _ in range(512):
+        value = 0
+        for _ in range(64 // _BITS_PER_BLOCK):
+            value = (value << _BITS_PER_BLOCK) | rng.randrange(_PALETTE_SIZE)
+        patterns.append(value if value < (1 << 63) else value - (1 << 64))
+
+    return patterns
+
+def _chunk(rng, patterns, chunk_x, chunk_z, fill):
+    filled_sections = int(round(_SECTIONS_PER_CHUNK * fill))
+
+    sections = []
+    for y in range(-4, _SECTIONS_PER_CHUNK - 4):
+        if y + 4 < filled_sections:
+            palette = rng.sample(_BLOCKS, _PALETTE_SIZE)
+            data = rng.choices(patterns, k=_long_count(_BITS_PER_BLOCK))
+            block_states = [("palette", _TAG_LIST, (_TAG_COMPOUND, [[("Name", _TAG_STRING, block)]
+                                                                    for block in palette])),
+                            ("data", _TAG_LONG_ARRAY, data)]
+        else:
+            block_states = [("palette", _TAG_LIST, (_TAG_COMPOUND, [[("Name", _TAG_STRING, "minecraft:air")]]))]
+
+        sections.append([("Y", _TAG_BYTE, y),
+                         ("block_states", _TAG_COMPOUND, block_states),
+                         ("biomes", _TAG_COMPOUND, [("palette", _TAG_LIST,
+                                                     (_TAG_STRING, [rng.choice(_BIOMES)]))])])
+
+    return _nbt("", [("DataVersion", _TAG_INT, DATA_VERSION),
+                     ("xPos", _TAG_INT, chunk_x),
+                     ("yPos", _TAG_INT, -4),
+                     ("zPos", _TAG_INT, chunk_z),
+                     ("Status", _TAG_STRING, "minecraft:full"),
+                     ("LastUpdate", _TAG_LONG, rng.randrange(1 << 32)),
+                     ("InhabitedTime", _TAG_LONG, rng.randrange(1 << 20)),
+                     ("sections", _TAG_LIST, (_TAG_COMPOUND, sections))])
+
+def _long_count(bits):
+    values_per_long = 64 // bits
+    return (_BLOCKS_PER_SECTION + values_per_long - 1) // values_per_long
+
+def _level_dat(rng):
+    return _nbt("", [("Data", _TAG_COMPOUND, [
+        ("DataVersion", _TAG_INT, DATA_VERSION),
+        ("LevelName", _TAG_STRING, "Synthetic World"),
+        ("GameType", _TAG_INT, 0),
+        ("SpawnX", _TAG_INT, 0),
+        ("SpawnY", _TAG_INT, 64),
+        ("SpawnZ", _TAG_INT, 0),
+        ("Time", _TAG_LONG, rng.randrange(1 << 32)),
+        ("DayTime", _TAG_LONG, rng.randrange(24000)),
+        ("LastPlayed", _TAG_LONG, 1700000000000),
+        ("version", _TAG_INT, 19133),
+        ("Version", _TAG_COMPOUND, [("Id", _TAG_INT, DATA_VERSION),
+                                    ("Name", _TAG_STRING, VERSION_NAME),
+                                    ("Series", _TAG_STRING, "main"),
+                                    ("Snapshot", _TAG_BYTE, 0)])])])
+
+def _player_dat(rng):
+    inventory = [[("Slot", _TAG_BYTE, slot), ("id", _TAG_STRING, rng.choice(_ITEMS)), ("Count", _TAG_BYTE, 1 + slot)]
+                 for slot in range(rng.randrange(36))]
+
+    return _nbt("", [("DataVersion", _TAG_INT, DATA_VERSION),
+                     ("Pos", _TAG_LIST, (_TAG_DOUBLE, [rng.uniform(-5000, 5000), rng.uniform(-60, 300),
+                                                       rng.uniform(-5000, 5000)])),
+                     ("Rotation", _TAG_LIST, (_TAG_FLOAT, [rng.uniform(0, 360), rng.uniform(-90, 90)])),
+                     ("Health", _TAG_FLOAT, 20.0),
+                     ("FoodLevel", _TAG_INT, rng.randrange(21)),
+                     ("XpLevel", _TAG_INT, rng.randrange(100)),
+                     ("playerGameType", _TAG_INT, 0),
+                     ("Dimension", _TAG_STRING, "minecraft:overworld"),
+                     ("Inventory", _TAG_LIST, (_TAG_COMPOUND, inventory))])
+
+def _stats_json(rng):
+    stats = {
+        "minecraft:custom" : {"minecraft:play_time" : rng.randrange(10000000),
+                              "minecraft:walk_one_cm" : rng.randrange(10000000),
+                              "minecraft:jump" : rng.randrange(100000),
+                              "minecraft:deaths" : rng.randrange(100)},
+        "minecraft:mined" : {block : rng.randrange(10000) for block in rng.sample(_BLOCKS, 8)},
+        "minecraft:used" : {item : rng.randrange(1000) for item in rng.sample(_ITEMS, 3)}
+    }
+    return json.dumps({"stats" : stats, "DataVersion" : DATA_VERSION}).encode('utf-8')
+
+def _advancements_json(rng):
+    advancements = {"minecraft:story/{}".format(name) : {
+        "criteria" : {name : "2023-11-{:02d} 12:00:00 +0000".format(rng.randrange(1, 29))}, "done" : True}
+        for name in rng.sample(["mine_stone", "upgrade_tools", "smelt_iron", "obtain_armor", "lava_bucket",
+                                "iron_tools", "deflect_arrow", "form_obsidian", "mine_diamond"], 4)}
+    advancements["DataVersion"] = DATA_VERSION
+    return json.dumps(advancements, indent=2).encode('utf-8')
+
+def _nbt(name, entries):
+    return struct.pack('>b', _TAG_COMPOUND) + _payload(_TAG_STRING, name) + _payload(_TAG_COMPOUND, entries)
+
+def _payload(tag, value):
+    if tag == _TAG_BYTE:
+        return struct.pack('>b', value)
+    elif tag == _TAG_SHORT:
+        return struct.pack('>h', value)
+    elif tag == _TAG_INT:
+        return struct.pack('>i', value)
+    elif tag == _TAG_LONG:
+        return struct.pack('>q', value)
+    elif tag == _TAG_FLOAT:
+        return struct.pack('>f', value)
+    elif tag == _TAG_DOUBLE:
+        return struct.pack('>d', value)
+    elif tag == _TAG_STRING:
+        encoded = value.encode('utf-8')
+        return struct.pack('>H', len(encoded)) + encoded
+    elif tag == _TAG_LIST:
+        (item_tag, items) = value
+        return struct.pack('>bi', item_tag if items else _TAG_END, len(items)) + \
+            b"".join(_payload(item_tag, item) for item in items)
+    elif tag == _TAG_COMPOUND:
+        return b"".join(struct.pack('>b', entry_tag) + _payload(_TAG_STRING, entry_name) +
+                        _payload(entry_tag, entry_value) for (entry_name, entry_tag, entry_value) in value) + \
+            struct.pack('>b', _TAG_END)
+    elif tag == _TAG_LONG_ARRAY:
+        return struct.pack('>i{}q'.format(len(value)), len(value), *value)
+
+    raise ValueError("Unsupported NBT tag {}".format(tag))
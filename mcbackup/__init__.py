@@ -1,3 +1,16 @@
-from .backup import WorldBackup
-from . import policy
-from . import meta
+import importlib
+
+# the submodules are imported on first use so a script only pays for the parts it needs
+_LAZY_ATTRIBUTES = {
+    'WorldBackup' : ('.backup', 'WorldBackup'),
+    'policy' : ('.policy', None),
+    'meta' : ('.meta', None),
+}
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    (module_name, attribute) = _LAZY_ATTRIBUTES[name]
+    module = importlib.import_module(module_name, __name__)
+    return getattr(module, attribute) if attribute else module
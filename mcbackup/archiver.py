@@ -1,5 +1,4 @@
-import zipfile
-import tarfile
+import io
 from functools import partial
 
 __all__ = ['Archiver', 'ZipArchiver', 'TarArchiver', 'ArchiverDefinition', 'DEFINITIONS']
@@ -7,6 +6,17 @@ __all__ = ['Archiver', 'ZipArchiver', 'TarArchiver', 'ArchiverDefinition', 'DEFI
 class Archiver(object):
     def add(self, file, archive_name):
         raise NotImplementedError()
+
+    def add_data(self, file, archive_name, data):
+        raise NotImplementedError()
+
+    def add_file(self, file_data):
+        if file_data.data is None:
+            self.add(file_data.full_path, file_data.archive_name)
+        else:
+            self.add_data(file_data.full_path, file_data.archive_name, file_data.data)
+
+        file_data.release()
     
     def close(self):
         raise NotImplementedError()
@@ -17,23 +27,45 @@ class Archiver(object):
     def __exit__(self, exec_type, exec_value, exec_traceback):
         self.close()
     
+# zipfile and tarfile, and through zipfile every compressor, are only imported once an archive of their kind is
+# opened rather than whenever a format is registered
 class ZipArchiver(Archiver):
-    def __init__(self, output_file, compression=zipfile.ZIP_DEFLATED):
+    def __init__(self, output_file, compression='ZIP_DEFLATED'):
+        import zipfile
+        if isinstance(compression, str):
+            compression = getattr(zipfile, compression)
         self.zip = zipfile.ZipFile(output_file, 'w', compression=compression)
         
     def add(self, file, archive_name):
         self.zip.write(file, archive_name)
+
+    def add_data(self, file, archive_name, data):
+        import zipfile
+        zip_info = zipfile.ZipInfo.from_file(file, archive_name)
+        zip_info.compress_type = self.zip.compression
+        self.zip.writestr(zip_info, data)
     
     def close(self):
         self.zip.close()
 
 class TarArchiver(Archiver):
     def __init__(self, output_file, compression='gz'):
+        import tarfile
         self.compression = compression
-        self.tar = tarfile.open(output_file, mode='w:' + compression)
+        if isinstance(output_file, str):
+            self.tar = tarfile.open(output_file, mode='w:' + compression)
+        else:
+            # file objects such as a TeeWriter are not seekable, so write them as a tar stream
+            self.tar = tarfile.open(fileobj=output_file, mode='w|' + compression)
         
     def add(self, file, archive_name):
         self.tar.add(file, archive_name)
+
+    def add_data(self, file, archive_name, data):
+        tar_info = self.tar.gettarinfo(file, archive_name)
+        # the file may have changed size since it was read, the buffered data is what gets archived
+        tar_info.size = len(data)
+        self.tar.addfile(tar_info, io.BytesIO(data))
         
     def close(self):
         self.tar.close()
@@ -53,10 +85,10 @@ DEFINITIONS = {}
 def _define_archive_format(archive_format, archiver_class, default_ext):
     DEFINITIONS[archive_format] = ArchiverDefinition(archive_format, archiver_class, default_ext)
 
-_define_archive_format('zip',           partial(ZipArchiver, compression=zipfile.ZIP_DEFLATED), 'zip')
-_define_archive_format('zip|deflate',   partial(ZipArchiver, compression=zipfile.ZIP_DEFLATED), 'zip')
-_define_archive_format('zip|bz2',       partial(ZipArchiver, compression=zipfile.ZIP_BZIP2),    'zip')
-_define_archive_format('tar',           partial(TarArchiver, compression=''),                   'tar')
-_define_archive_format('tar|gz',        partial(TarArchiver, compression='gz'),                 'tar.gz')
-_define_archive_format('tar|bz2',       partial(TarArchiver, compression='bz2'),                'tar.bz2')
-_define_archive_format('tar|xz',        partial(TarArchiver, compression='xz'),                 'tar.xz')
+_define_archive_format('zip',           partial(ZipArchiver, compression='ZIP_DEFLATED'),    'zip')
+_define_archive_format('zip|deflate',   partial(ZipArchiver, compression='ZIP_DEFLATED'),    'zip')
+_define_archive_format('zip|bz2',       partial(ZipArchiver, compression='ZIP_BZIP2'),       'zip')
+_define_archive_format('tar',           partial(TarArchiver, compression=''),                'tar')
+_define_archive_format('tar|gz',        partial(TarArchiver, compression='gz'),              'tar.gz')
+_define_archive_format('tar|bz2',       partial(TarArchiver, compression='bz2'),             'tar.bz2')
+_define_archive_format('tar|xz',        partial(TarArchiver, compression='xz'),              'tar.xz')
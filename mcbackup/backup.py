@@ -1,10 +1,20 @@
 import os
+import uuid
 import datetime
-from dateutil.tz import tzlocal, tzutc
 from .archiver import DEFINITIONS
+from .reader import PipelinedReader
 from . import meta
 
-__all__ = ['WorldBackup', 'backup']
+__all__ = ['WorldBackup', 'BackupTarget', 'BackupError', 'WorldReadError', 'backup', 'backup_to_targets']
+
+class BackupError(Exception):
+    pass
+
+class WorldReadError(BackupError):
+    def __init__(self, world, error):
+        super(WorldReadError, self).__init__("Could not read world {}: {}".format(world, error))
+        self.world = world
+        self.error = error
 
 class WorldBackup(object):
     @staticmethod
@@ -20,7 +30,7 @@ class WorldBackup(object):
                     
         return worlds
     
-    def __init__(self, world_path, archiver, output_file):
+    def __init__(self, world_path, archiver, output_file, reader=None):
         if not os.path.exists(world_path):
             raise ValueError("The world {} does not exists".format(world_path))
 
@@ -30,56 +40,244 @@ class WorldBackup(object):
         self.world_path = world_path
         self.archiver = archiver
         self.output_file = output_file
+        self.reader = reader if reader else PipelinedReader()
         
     def run(self):
+        with self.archiver.open(self.output_file) as file_archiver:
+            for file_data in self.reader.read(self._list_files()):
+                file_archiver.add_file(file_data)
+
+    def _list_files(self):
         world_dir = os.path.dirname(self.world_path)
 
-        with self.archiver.open(self.output_file) as file_archiver:
-            for (dirpath, _, files) in os.walk(self.world_path):
-                for file in files:
-                    full_path = os.path.join(dirpath, file)
-                    relative_path = os.path.relpath(full_path, world_dir)
-                    
-                    file_archiver.add(full_path, relative_path)
-        
-def backup(world_dir, worlds, backup_dir, filename_format, archive_format, retention_policy):
+        for (dirpath, _, files) in os.walk(self.world_path):
+            for file in files:
+                full_path = os.path.join(dirpath, file)
+                relative_path = os.path.relpath(full_path, world_dir)
+                
+                yield (full_path, relative_path)
+
+class BackupTarget(object):
+    def __init__(self, backup_dir, retention_policy, replicator=None, shard_by_world=False, server_name=None):
+        self.backup_dir = backup_dir
+        self.retention_policy = retention_policy
+        self.replicator = replicator
+        self.shard_by_world = shard_by_world
+        self.server_name = server_name
+        self.begin()
+
+    def begin(self):
+        self.worlds_meta = []
+        self.error = None
+
+    def fail(self, error):
+        print ("Backup target {} failed: {}".format(self.backup_dir, error))
+        self.error = error
+
+    def shard_for_world(self, world):
+        parts = [part for part in (self.server_name, world if self.shard_by_world else None) if part]
+        return ".".join(parts) if parts else None
+
+    def save(self, backup_id, backup_time, archive_format):
+        if self.shard_by_world or self.server_name:
+            meta.migrate_to_shards(self.backup_dir, self.shard_for_world)
+
+        worlds_by_shard = {}
+        for world_meta in self.worlds_meta:
+            worlds_by_shard.setdefault(self.shard_for_world(world_meta.name), []).append(world_meta)
+
+        for (shard, worlds) in sorted(worlds_by_shard.items(), key=lambda item: item[0] or ''):
+            catalog = meta.Catalog(self.backup_dir, shard)
+            catalog.append(meta.BackupMeta(backup_id, backup_time, archive_format=archive_format, worlds=worlds))
+            self._apply_retention(catalog)
+
+        if self.replicator is not None:
+            self.replicator.replicate(self.backup_dir, meta.load_meta(self.backup_dir))
+
+    def _apply_retention(self, catalog):
+        try:
+            with catalog.transaction(blocking=False) as transaction:
+                # a snapshot the same policy produced only needs the new journal entries evaluated
+                retention = repr(self.retention_policy)
+                if transaction.stored_retention == retention:
+                    (transaction.backups, purge) = self.retention_policy.apply_incremental(transaction.backups,
+                                                                                           transaction.appended)
+                else:
+                    (transaction.backups, purge) = self.retention_policy.apply(transaction.backups)
+                transaction.retention = retention
+                delete_backups(self.backup_dir, purge)
+        except meta.CatalogBusyError:
+            # whoever holds the lock is applying the policy already, our entry gets picked up by the next run
+            print ("Skipping retention for {}, it is being applied by another backup".format(catalog.snapshot_path))
+
+    def __repr__(self):
+        return "BackupTarget{{backup_dir={}}}".format(self.backup_dir)
+
+def backup(world_dir, worlds, backup_dir, filename_format, archive_format, retention_policy, replicator=None,
+           segment_size=None):
+    backup_to_targets(world_dir, worlds, [BackupTarget(backup_dir, retention_policy, replicator)], filename_format,
+                      archive_format, segment_size)
+
+def backup_to_targets(world_dir, worlds, targets, filename_format, archive_format, segment_size=None):
     archiver = DEFINITIONS[archive_format]
     worlds = worlds if worlds else WorldBackup.get_all_worlds(world_dir)
+    targets = list(targets)
+
+    if segment_size and len(targets) > 1:
+        raise ValueError("Segmented backups can only be written to a single backup target")
+
+    for target in targets:
+        target.begin()
 
-    meta_data = meta.load_meta(backup_dir)
-    worlds_meta = []
+    backup_id = str(uuid.uuid4())
+    backup_time = datetime.datetime.now(datetime.timezone.utc)
+    failed_worlds = []
     for world in worlds:
+        live_targets = [target for target in targets if target.error is None]
+        if not live_targets:
+            break
+
         world_path = os.path.join(world_dir, world)
-        output_file = create_output_file(filename_format, backup_dir, world, archiver)
+        try:
+            if segment_size:
+                _backup_world_segmented(world, world_path, archiver, filename_format, live_targets[0], segment_size)
+            elif len(live_targets) == 1:
+                _backup_world(world, world_path, archiver, filename_format, live_targets[0])
+            else:
+                _fan_out_world(world, world_path, archiver, filename_format, live_targets)
+        except WorldReadError as e:
+            # the world changed under us, e.g. the server removed a file, the targets are fine for the other worlds
+            print (e)
+            failed_worlds.append(world)
+
+    for target in targets:
+        if target.error is not None and not target.worlds_meta:
+            continue
 
-        print ("Backing up {} to {}".format(world, output_file))
+        try:
+            target.save(backup_id, backup_time, archiver.format)
+        except Exception as e:
+            target.fail(e)
+
+    failed_targets = [target for target in targets if target.error is not None]
+    if failed_targets:
+        raise BackupError("Backup failed for {} of {} target(s): {}".format(
+            len(failed_targets), len(targets), ", ".join(target.backup_dir for target in failed_targets)))
+
+    if failed_worlds:
+        raise BackupError("Backup failed for {} of {} world(s): {}".format(
+            len(failed_worlds), len(worlds), ", ".join(failed_worlds)))
+
+def _backup_world(world, world_path, archiver, filename_format, target):
+    output_file = create_output_file(filename_format, target.backup_dir, world, archiver)
+
+    print ("Backing up {} to {}".format(world, output_file))
+    try:
         backup_task = WorldBackup(world_path, archiver, output_file)
         backup_task.run()
-        worlds_meta.append(meta.WorldMeta(world, os.path.relpath(output_file, backup_dir)))
+    except OSError as e:
+        _remove_partial_file(output_file)
+        if _is_read_error(e, world_path):
+            raise WorldReadError(world, e)
+        target.fail(e)
+        return
+
+    target.worlds_meta.append(meta.WorldMeta(world, os.path.relpath(output_file, target.backup_dir)))
+
+def _backup_world_segmented(world, world_path, archiver, filename_format, target, segment_size):
+    from .checkpoint import CheckpointedWorldBackup, progress_path
+
+    # an unfinished backup of this world is resumed into its original files, so the name is only a suggestion
+    output_file = os.path.join(target.backup_dir, format_output_file(filename_format, world, archiver))
+    progress_file = progress_path(target.backup_dir, target.shard_for_world(world) or world)
+
+    try:
+        backup_task = CheckpointedWorldBackup(world_path, archiver, target.backup_dir, output_file, progress_file,
+                                              segment_size)
+        print ("Backing up {} to {}".format(world, backup_task.output_file))
+        segments = backup_task.run()
+    except OSError as e:
+        # completed segments are kept, the next run resumes from them
+        if _is_read_error(e, world_path):
+            raise WorldReadError(world, e)
+        target.fail(e)
+        return
+
+    target.worlds_meta.append(meta.WorldMeta(world, segments[0], segments))
 
-    meta_data.append(meta.BackupMeta(archive_format=archiver.format, worlds=worlds_meta))
+def _fan_out_world(world, world_path, archiver, filename_format, targets):
+    from .tee import TeeWriter, TeeError
 
+    output_files = {}
+    for target in targets:
+        try:
+            output_file = create_output_file(filename_format, target.backup_dir, world, archiver)
+            output_files[target] = (output_file, open(output_file, 'wb'))
+        except OSError as e:
+            target.fail(e)
+
+    if not output_files:
+        return
+
+    print ("Backing up {} to {}".format(world, ", ".join(output_file for (output_file, _) in output_files.values())))
+    tee = TeeWriter([(target, file) for (target, (_, file)) in output_files.items()])
+    read_error = None
     try:
-        (meta_data, purge) = retention_policy.apply(meta_data)
-        delete_backups(backup_dir, purge)
+        backup_task = WorldBackup(world_path, archiver, tee)
+        backup_task.run()
+    except TeeError:
+        # every destination failed, each one's own error is reported below
+        pass
+    except OSError as e:
+        # writes only fail through the tee, anything else is a problem reading the world
+        read_error = e
     finally:
-        meta.save_meta(backup_dir, meta_data)
+        tee.close()
 
-def create_output_file(filename_format, backup_dir, world_name, archiver):
-    current_date = datetime.datetime.now(tzlocal())
-    current_date_utc = datetime.datetime.now(tzutc())
+    if read_error is not None:
+        for (output_file, _) in output_files.values():
+            _remove_partial_file(output_file)
+        raise WorldReadError(world, read_error)
+
+    failures = tee.failures
+    for (target, (output_file, _)) in output_files.items():
+        if target in failures:
+            target.fail(failures[target])
+            _remove_partial_file(output_file)
+        else:
+            target.worlds_meta.append(meta.WorldMeta(world, os.path.relpath(output_file, target.backup_dir)))
+
+def format_output_file(filename_format, world_name, archiver):
+    current_date = datetime.datetime.now().astimezone()
+    current_date_utc = datetime.datetime.now(datetime.timezone.utc)
             
-    relative_path = filename_format.format(now=current_date, utcnow=current_date_utc, world=world_name,
-                                           ext=archiver.default_ext)
-    output_file = os.path.join(backup_dir, relative_path)
+    return filename_format.format(now=current_date, utcnow=current_date_utc, world=world_name,
+                                  ext=archiver.default_ext)
+
+def create_output_file(filename_format, backup_dir, world_name, archiver):
+    output_file = os.path.join(backup_dir, format_output_file(filename_format, world_name, archiver))
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
     return output_file    
 
+def _is_read_error(error, world_path):
+    # errors reading the world name the world file, errors writing the archive name the archive or nothing at all
+    filename = getattr(error, 'filename', None)
+    if not isinstance(filename, str):
+        return False
+    return os.path.abspath(filename).startswith(os.path.abspath(world_path) + os.sep)
+
+def _remove_partial_file(output_file):
+    try:
+        os.unlink(output_file)
+    except OSError:
+        pass
+
 def delete_backups(backup_dir, backups):
     for backup_meta in backups:
         for world_meta in backup_meta.worlds:
-            world_path = os.path.join(backup_dir, world_meta.path)
-            print ("Deleting old backup {}".format(world_path))
-            os.unlink(world_path)
+            for path in world_meta.paths:
+                world_path = os.path.join(backup_dir, path)
+                print ("Deleting old backup {}".format(world_path))
+                os.unlink(world_path)
 
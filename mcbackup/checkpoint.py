@@ -0,0 +1,196 @@
+import os
+import json
+import hashlib
+from .reader import PipelinedReader
+
+__all__ = ['CheckpointedWorldBackup', 'Progress', 'segment_path', 'progress_path']
+
+_PROGRESS_DIR = ".progress"
+
+def segment_path(output_file, ext, number):
+    base = output_file[:-len(ext) - 1] if output_file.endswith("." + ext) else output_file
+    return "{}.part{:04d}.{}".format(base, number, ext)
+
+def progress_path(backup_dir, name):
+    return os.path.join(backup_dir, _PROGRESS_DIR, "{}.json".format(name))
+
+class Progress(object):
+    def __init__(self, path, output_file, archive_format, segment_size, segments=None):
+        self.path = path
+        self.output_file = output_file
+        self.archive_format = archive_format
+        self.segment_size = segment_size
+        self.segments = segments if segments else []
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'r') as file:
+            data = json.load(file)
+
+        return cls(path, data['output_file'], data['archive_format'], data['segment_size'], data['segments'])
+
+    def done_files(self):
+        return set(name for segment in self.segments for name in segment['files'])
+
+    def verify(self, backup_dir):
+        # a segment is only trusted if it is still on disk with the checksum it was recorded with, and since every
+        # later segment was written after it, the first bad segment invalidates the rest
+        for (i, segment) in enumerate(self.segments):
+            segment_file = os.path.join(backup_dir, segment['path'])
+            if not os.path.exists(segment_file) or os.path.getsize(segment_file) != segment['bytes'] or \
+                    _sha256(segment_file) != segment['sha256']:
+                for stale in self.segments[i:]:
+                    _remove(os.path.join(backup_dir, stale['path']))
+                self.segments = self.segments[:i]
+                self.save()
+                return
+
+    def add_segment(self, path, files, size, sha256):
+        self.segments.append({'path' : path, 'files' : files, 'bytes' : size, 'sha256' : sha256})
+        self.save()
+
+    def discard(self, backup_dir):
+        for segment in self.segments:
+            _remove(os.path.join(backup_dir, segment['path']))
+        self.finish()
+
+    def finish(self):
+        _remove(self.path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({'output_file' : self.output_file, 'archive_format' : self.archive_format,
+                       'segment_size' : self.segment_size, 'segments' : self.segments}, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmp_path, self.path)
+
+class CheckpointedWorldBackup(object):
+    def __init__(self, world_path, archiver, backup_dir, output_file, progress_file, segment_size, reader=None):
+        if not os.path.isdir(world_path):
+            raise ValueError("The world {} is not a directory".format(world_path))
+
+        if segment_size <= 0:
+            raise ValueError("The segment size must be greater than zero")
+
+        self.world_path = world_path
+        self.archiver = archiver
+        self.backup_dir = backup_dir
+        self.segment_size = segment_size
+        self.reader = reader if reader else PipelinedReader()
+
+        progress = Progress.load(progress_file)
+        if progress is not None and (progress.archive_format != archiver.format or
+                                     progress.segment_size != segment_size):
+            print ("Discarding unfinished backup of {} made with different settings".format(world_path))
+            progress.discard(backup_dir)
+            progress = None
+
+        if progress is None:
+            progress = Progress(progress_file, os.path.relpath(output_file, backup_dir), archiver.format, segment_size)
+            progress.save()
+        else:
+            progress.verify(backup_dir)
+            print ("Resuming backup of {} after {} completed segment(s)".format(world_path, len(progress.segments)))
+
+        self.progress = progress
+
+    @property
+    def output_file(self):
+        return os.path.join(self.backup_dir, self.progress.output_file)
+
+    def run(self):
+        done_files = self.progress.done_files()
+        pending = [(full_path, archive_name) for (full_path, archive_name) in self._list_files()
+                   if archive_name not in done_files]
+
+        os.makedirs(os.path.dirname(self.output_file), exist_ok=True)
+        files = iter(self.reader.read(pending))
+        file_data = next(files, None)
+        while file_data is not None or not self.progress.segments:
+            self._write_segment(file_data, files)
+            file_data = next(files, None)
+
+        segments = [segment['path'] for segment in self.progress.segments]
+        self.progress.finish()
+        return segments
+
+    def _write_segment(self, file_data, files):
+        number = len(self.progress.segments) + 1
+        output_file = segment_path(self.output_file, self.archiver.default_ext, number)
+        partial_file = output_file + ".partial"
+
+        # segments are written under a temporary name and only recorded once complete, so an interruption at any
+        # point leaves either a finished, checksummed segment or nothing
+        archive_names = []
+        with open(partial_file, 'wb') as raw_file:
+            hashing_file = _HashingWriter(raw_file)
+            with self.archiver.open(hashing_file) as file_archiver:
+                while file_data is not None:
+                    hashing_file.consumed += _file_size(file_data)
+                    archive_names.append(file_data.archive_name)
+                    file_archiver.add_file(file_data)
+
+                    # the next file is only read once this segment is closed, so nothing read is ever lost
+                    if hashing_file.consumed >= self.segment_size:
+                        break
+                    file_data = next(files, None)
+
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+
+        os.replace(partial_file, output_file)
+        print ("Finished segment {} of {} ({} files)".format(number, self.world_path, len(archive_names)))
+        self.progress.add_segment(os.path.relpath(output_file, self.backup_dir), archive_names,
+                                  hashing_file.written, hashing_file.hexdigest())
+
+    def _list_files(self):
+        world_dir = os.path.dirname(self.world_path)
+
+        # resuming relies on visiting the files in the same order every run
+        for (dirpath, dirnames, files) in os.walk(self.world_path):
+            dirnames.sort()
+            for file in sorted(files):
+                full_path = os.path.join(dirpath, file)
+                yield (full_path, os.path.relpath(full_path, world_dir))
+
+def _file_size(file_data):
+    return os.path.getsize(file_data.full_path) if file_data.data is None else len(file_data.data)
+
+class _HashingWriter(object):
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+        self.written = 0
+        self.consumed = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.written += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+def _sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,5 @@
+# defaults of the optional features, kept free of imports so the scripts can show them in their help without loading
+# the modules that implement those features
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_WORKERS = 4
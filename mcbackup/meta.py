@@ -4,11 +4,12 @@ import importlib
 import uuid
 import re
 import os
-from dateutil.parser import parse
-from dateutil.tz import tzutc
+import fcntl
+from contextlib import contextmanager
 
 __all__ = ['TAG_SNAPSHOT', 'TAG_HOURLY', 'TAG_DAILY', 'TAG_WEEKLY', 'TAG_MONTHLY', 'TAG_YEARLY', 'BackupMeta',
-           'WorldMeta', 'load_meta', 'save_meta']
+           'WorldMeta', 'Catalog', 'CatalogBusyError', 'load_meta', 'save_meta', 'list_shards', 'catalog_files',
+           'migrate_to_shards']
 
 TAG_SNAPSHOT = 'snapshot'
 TAG_HOURLY = 'hourly'
@@ -18,15 +19,17 @@ TAG_MONTHLY = 'monthly'
 TAG_YEARLY = 'yearly'
 
 class BackupMeta(object):
-    def __init__(self, backup_id=None, time=None, archive_format=None, worlds=[], tag=TAG_SNAPSHOT):
+    def __init__(self, backup_id=None, time=None, archive_format=None, worlds=[], tag=TAG_SNAPSHOT, parent_id=None):
         self.id = backup_id if backup_id else str(uuid.uuid4())
-        self.time = time if time else datetime.datetime.now(tzutc())
+        self.time = time if time else datetime.datetime.now(datetime.timezone.utc)
         self.archive_format = archive_format
         self.worlds = worlds if worlds else []
         self.tag = tag
+        # the id of the backup this entry was split from, when its worlds are retained under different policies
+        self.parent_id = parent_id
 
     def retag(self, new_tag):
-        return BackupMeta(self.id, self.time, self.archive_format, self.worlds, new_tag)
+        return BackupMeta(self.id, self.time, self.archive_format, self.worlds, new_tag, self.parent_id)
 
     def __eq__(self, other):
         if isinstance(other, BackupMeta):
@@ -42,9 +45,14 @@ class BackupMeta(object):
             self.id, self.time.isoformat(), self.worlds, self.tag)
 
 class WorldMeta(object):
-    def __init__(self, name=None, path=None):
+    def __init__(self, name=None, path=None, segments=None):
         self.name = name
         self.path = path
+        self.segments = segments
+
+    @property
+    def paths(self):
+        return self.segments if self.segments else [self.path]
 
     def __eq__(self, other):
         if isinstance(other, WorldMeta):
@@ -53,26 +61,202 @@ class WorldMeta(object):
         return False
 
 def load_meta(backup_dir):
-    meta_path = _get_meta_path(backup_dir)
+    meta_data = Catalog(backup_dir).load()
+    for shard in list_shards(backup_dir):
+        meta_data.extend(Catalog(backup_dir, shard).load())
 
-    if os.path.exists(meta_path):
-        with open(meta_path, 'r') as file:
-            return MetaDataJSONDecoder().decode(file.read())
-    else:
-        return []
+    return meta_data
 
 def save_meta(backup_dir, meta_data):
-    meta_path = _get_meta_path(backup_dir)
-    with open(meta_path, 'w') as file:
-        file.write(MetaDataJSONEncoder().encode(meta_data))
+    with Catalog(backup_dir).transaction() as transaction:
+        transaction.backups = meta_data
+
+def list_shards(backup_dir):
+    shard_dir = os.path.join(backup_dir, _SHARD_DIR)
+    if not os.path.isdir(shard_dir):
+        return []
+
+    shards = set()
+    for name in os.listdir(shard_dir):
+        (shard, ext) = os.path.splitext(name)
+        if ext in (_SNAPSHOT_EXT, _JOURNAL_EXT):
+            shards.add(shard)
+
+    return sorted(shards)
+
+def catalog_files(backup_dir):
+    catalogs = [Catalog(backup_dir)] + [Catalog(backup_dir, shard) for shard in list_shards(backup_dir)]
+    return [path for catalog in catalogs for path in (catalog.snapshot_path, catalog.journal_path)
+            if os.path.exists(path)]
+
+def migrate_to_shards(backup_dir, shard_for_world):
+    # moves the entries of the single meta.json catalog into the shards their worlds now belong to
+    legacy = Catalog(backup_dir)
+    if not legacy.load():
+        return
+
+    with legacy.transaction() as transaction:
+        for backup_meta in transaction.backups:
+            worlds_by_shard = {}
+            for world_meta in backup_meta.worlds:
+                worlds_by_shard.setdefault(shard_for_world(world_meta.name), []).append(world_meta)
+
+            for (shard, worlds) in worlds_by_shard.items():
+                Catalog(backup_dir, shard).append(BackupMeta(backup_meta.id, backup_meta.time,
+                                                             backup_meta.archive_format, worlds, backup_meta.tag,
+                                                             backup_meta.parent_id))
+
+        transaction.backups = []
+
+_LEGACY_NAME = "meta"
+_SHARD_DIR = "catalog"
+_SNAPSHOT_EXT = ".json"
+_JOURNAL_EXT = ".journal"
+_LOCK_EXT = ".lock"
+_RETENTION_EXT = ".retention"
+
+class CatalogBusyError(Exception):
+    pass
+
+class CatalogTransaction(object):
+    def __init__(self, backups, appended, stored_retention=None):
+        self.backups = backups
+        # the entries appended to the journal since the snapshot was last written
+        self.appended = appended
+        # identifies the retention policy that produced the snapshot being read
+        self.stored_retention = stored_retention
+        # the policy that produced the snapshot being written, only a writer that applied one sets it
+        self.retention = None
+
+# a catalog is a JSON snapshot plus an append-only journal of newer entries.  Appends only take a shared lock so
+# concurrent backups never wait on each other, rewriting the snapshot takes an exclusive lock on this catalog alone.
+class Catalog(object):
+    def __init__(self, backup_dir, shard=None):
+        if shard is None:
+            base_path = os.path.join(backup_dir, _LEGACY_NAME)
+        else:
+            if not shard or os.sep in shard or shard.startswith('.'):
+                raise ValueError("The catalog shard name {} is not a valid file name".format(shard))
+            base_path = os.path.join(backup_dir, _SHARD_DIR, shard)
+
+        self.backup_dir = backup_dir
+        self.shard = shard
+        self.snapshot_path = base_path + _SNAPSHOT_EXT
+        self.journal_path = base_path + _JOURNAL_EXT
+        self.lock_path = base_path + _LOCK_EXT
+        self.retention_path = base_path + _RETENTION_EXT
 
-def _get_meta_path(backup_dir):
-    return os.path.join(backup_dir, "meta.json")
+    def load(self):
+        # reading never creates anything, so listing a read-only or mistyped backup dir leaves it untouched
+        with self._lock(fcntl.LOCK_SH, create=False):
+            (backups, appended) = self._read()
+            return backups + appended
+
+    def append(self, backup_meta):
+        line = (MetaDataJSONEncoder().encode(backup_meta) + "\n").encode('utf-8')
+
+        # O_APPEND makes each entry a single write at the end of the journal, so concurrent appends never interleave
+        with self._lock(fcntl.LOCK_SH):
+            fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    @contextmanager
+    def transaction(self, blocking=True):
+        with self._lock(fcntl.LOCK_EX, blocking):
+            (backups, appended) = self._read()
+            retention = self._read_retention()
+            transaction = CatalogTransaction(backups + appended, appended, retention)
+            try:
+                yield transaction
+            finally:
+                self._write(transaction.backups, retention, transaction.retention)
+
+    @contextmanager
+    def _lock(self, operation, blocking=True, create=True):
+        if create:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            lock_file = open(self.lock_path, 'a')
+        else:
+            try:
+                lock_file = open(self.lock_path, 'r')
+            except OSError:
+                # no writer has locked the catalog yet, or it is not readable: the snapshot is replaced
+                # atomically, so an unlocked read still sees a whole one
+                yield
+                return
+
+        with lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), operation if blocking else operation | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise CatalogBusyError("The catalog {} is locked by another process".format(self.snapshot_path))
+
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read(self):
+        backups = []
+        appended = []
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as file:
+                backups = MetaDataJSONDecoder().decode(file.read())
+
+        if os.path.exists(self.journal_path):
+            # an entry split up by the retention policy is part of the snapshot under the ids of its pieces
+            known_ids = set(backup.id for backup in backups) | \
+                set(backup.parent_id for backup in backups if backup.parent_id is not None)
+            decoder = MetaDataJSONDecoder()
+            with open(self.journal_path, 'r') as file:
+                for line in file:
+                    # a crash can leave a partial last line, and a crash after a rewrite can leave entries that
+                    # are already part of the snapshot
+                    if not line.endswith("\n"):
+                        break
+
+                    backup = decoder.decode(line)
+                    if backup.id not in known_ids:
+                        known_ids.add(backup.id)
+                        appended.append(backup)
+
+        return (backups, appended)
+
+    def _read_retention(self):
+        if not os.path.exists(self.retention_path):
+            return None
+
+        with open(self.retention_path, 'r') as file:
+            return file.read()
+
+    def _write(self, backups, old_retention, new_retention):
+        # the old marker goes before the snapshot changes and the new one only once it is written, so a marker
+        # never vouches for a snapshot the named policy did not produce
+        if old_retention is not None and old_retention != new_retention:
+            os.unlink(self.retention_path)
+
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            file.write(MetaDataJSONEncoder().encode(backups))
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmp_path, self.snapshot_path)
+        if os.path.exists(self.journal_path):
+            os.truncate(self.journal_path, 0)
+
+        if new_retention is not None and new_retention != old_retention:
+            with open(self.retention_path, 'w') as file:
+                file.write(new_retention)
 
 class MetaDataJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime.datetime):
-            value = obj.astimezone(tzutc()).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            value = obj.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
             # strip off the microseconds part leaving on milliseconds
             return value[:23] + value[26:]
         else:
@@ -82,7 +266,8 @@ class MetaDataJSONEncoder(json.JSONEncoder):
 
 class MetaDataJSONDecoder(json.JSONDecoder):
     def __init__(self, parse_float=None, parse_int=None, parse_constant=None, strict=True):
-        super(MetaDataJSONDecoder, self).__init__(_object_hook, parse_float, parse_int, parse_constant, strict)
+        super(MetaDataJSONDecoder, self).__init__(object_hook=_object_hook, parse_float=parse_float,
+                                                  parse_int=parse_int, parse_constant=parse_constant, strict=strict)
 
     def decode(self, s, *args, **kwargs):
         result = super(MetaDataJSONDecoder, self).decode(s, *args, **kwargs)
@@ -113,10 +298,13 @@ def _parse_value(value):
     else:
         return value
 
+_TIME_PATTERN = re.compile(r'\d\d\d\d-\d\d-\d\dT\d\d:\d\d:\d\d\.\d\d\dZ$')
+
 def _handle_string(value):
-    if re.match(r'\d\d\d\d-\d\d-\d\dT\d\d:\d\d:\d\d\.\d\d\dZ', value):
+    if _TIME_PATTERN.match(value):
+        # the encoder always writes this one format, so it needs none of the generality of dateutil's parser
         try:
-            return parse(value)
+            return datetime.datetime.fromisoformat(value[:-1]).replace(tzinfo=datetime.timezone.utc)
         except ValueError:
             return value
     else:
@@ -1,9 +1,11 @@
 import datetime
+import fnmatch
+import operator
+from bisect import bisect_left
 from itertools import chain
 from .. import meta
-from dateutil.tz import tzutc
 
-__all__ = ["RetentionPolicy", "RetentionRule", "Duration", "DurationForever"]
+__all__ = ["RetentionPolicy", "WorldRetentionPolicy", "RetentionRule", "Duration", "DurationForever"]
 
 class RetentionPolicy(object):
     def __init__(self, rules):
@@ -19,10 +21,15 @@ class RetentionPolicy(object):
 
             last_rule = rule
 
-    def apply(self, backups):
+    def apply(self, backups, now=None):
+        now = now if now else datetime.datetime.now(datetime.timezone.utc)
         purge = {}
         last_rule = None
-        
+
+        # the pieces a WorldRetentionPolicy split a backup into are one backup again under a single policy
+        if any(backup.parent_id is not None for backup in backups):
+            backups = _split_by_group(backups, lambda world: None).get(None, [])
+
         grouped_backups = _group_backups_by_tag(backups)
         for rule in self.rules:
             # find backups purged by the previous rule that should be tagged with this rule's tag
@@ -35,7 +42,7 @@ class RetentionPolicy(object):
             # purge expired backups
             purge[rule.tag] = set()
             for backup in grouped_backups[rule.tag].copy():
-                if rule.is_expired(backup):
+                if rule.is_expired(backup, now):
                     grouped_backups[rule.tag].remove(backup)
                     purge[rule.tag].add(backup)
 
@@ -49,6 +56,62 @@ class RetentionPolicy(object):
 
         return (list(chain.from_iterable(grouped_backups.values())), list(chain.from_iterable(purge.values())))
 
+    def apply_incremental(self, backups, new_backups, now=None):
+        """Same result as apply, provided the backups other than new_backups are what a previous apply kept.
+
+        In that state no tag holds expired backups or two backups of one time bucket, so only the backups of each tag
+        old enough to have expired since, and the buckets new and retagged backups join need to be looked at.
+        """
+        now = now if now else datetime.datetime.now(datetime.timezone.utc)
+        new_ids = set(backup.id for backup in new_backups)
+
+        # the catalog is kept in time order, so this sort is a single pass over already sorted runs
+        all_backups = _TimeIndex(sorted(backups, key=operator.attrgetter("time")))
+        grouped_backups = {tag : [] for tag in _TAGS}
+        joined = {tag : [] for tag in _TAGS}
+        for backup in all_backups.backups:
+            grouped_backups[backup.tag].append(backup)
+            if backup.id in new_ids:
+                joined[backup.tag].append(backup)
+        grouped_backups = {tag : _TimeIndex(backups_for_tag) for (tag, backups_for_tag) in grouped_backups.items()}
+
+        purge = []
+        candidates = []
+        last_rule = None
+        for rule in self.rules:
+            backups_for_tag = grouped_backups[rule.tag]
+
+            # find backups purged by the previous rule that should be tagged with this rule's tag
+            if last_rule is not None:
+                for candidate in candidates:
+                    if rule.tagger.support_retag and candidate == all_backups.first_in_bucket(rule.tagger,
+                                                                                              candidate.time):
+                        retagged = candidate.retag(rule.tag)
+                        backups_for_tag.insert(retagged)
+                        joined[rule.tag].append(retagged)
+                    else:
+                        purge.append(candidate)
+
+            # only backups older than the duration's bound can have expired, though not necessarily all of them
+            candidates = backups_for_tag.pop_expired(rule.duration, now)
+
+            # only the buckets that gained a backup can hold more than one
+            seen_buckets = set()
+            for backup in joined[rule.tag]:
+                (start, end) = rule.tagger.bucket_bounds(backup.time)
+                if start in seen_buckets:
+                    continue
+                seen_buckets.add(start)
+
+                candidates.extend(backups_for_tag.pop_duplicates(rule.tagger, start, end))
+
+            last_rule = rule
+
+        purge.extend(candidates)
+        keep = sorted(chain.from_iterable(index.backups for index in grouped_backups.values()),
+                      key=operator.attrgetter("time"))
+        return (keep, purge)
+
     def __eq__(self, other):
         if isinstance(other, RetentionPolicy):
             return self.rules == other.rules
@@ -57,6 +120,140 @@ class RetentionPolicy(object):
     def __repr__(self):
         return "RetentionPolicy{{rules=[{}]}}".format(','.join([repr(rule) for rule in self.rules]))
 
+class WorldRetentionPolicy(object):
+    """Applies a separate policy to the worlds matching each glob pattern, and the default policy to the rest."""
+
+    def __init__(self, default, overrides=None):
+        self.default = default
+        self.overrides = overrides if overrides else []
+
+    def policy_for(self, world):
+        group = self._group_for(world)
+        return self.default if group is None else self.overrides[group][1]
+
+    def apply(self, backups, now=None):
+        return self._apply_grouped(lambda policy, group, new_group: policy.apply(group, now), backups, [])
+
+    def apply_incremental(self, backups, new_backups, now=None):
+        return self._apply_grouped(lambda policy, group, new_group: policy.apply_incremental(group, new_group, now),
+                                   backups, new_backups)
+
+    def _apply_grouped(self, apply, backups, new_backups):
+        groups = self._split(backups)
+        new_groups = self._split(new_backups)
+
+        keep = []
+        purge = []
+        for (group, group_backups) in groups.items():
+            policy = self.default if group is None else self.overrides[group][1]
+            (group_keep, group_purge) = apply(policy, group_backups, new_groups.get(group, []))
+            keep.extend(group_keep)
+            purge.extend(group_purge)
+
+        keep.sort(key=operator.attrgetter("time"))
+        return (keep, purge)
+
+    def _split(self, backups):
+        return _split_by_group(backups, self._group_for)
+
+    def _group_for(self, world):
+        for (i, (pattern, _)) in enumerate(self.overrides):
+            if fnmatch.fnmatchcase(world, pattern):
+                return i
+        return None
+
+    def __eq__(self, other):
+        if isinstance(other, WorldRetentionPolicy):
+            return self.default == other.default and self.overrides == other.overrides
+        return False
+
+    def __repr__(self):
+        return "WorldRetentionPolicy{{default={},overrides=[{}]}}".format(
+            repr(self.default), ','.join(["{}={}".format(pattern, repr(policy))
+                                          for (pattern, policy) in self.overrides]))
+
+class _TimeIndex(object):
+    """A time ordered list of backups that supports bisecting by time."""
+
+    def __init__(self, backups):
+        self.backups = backups
+        self.times = [backup.time for backup in backups]
+
+    def insert(self, backup):
+        i = bisect_left(self.times, backup.time)
+        self.times.insert(i, backup.time)
+        self.backups.insert(i, backup)
+
+    def first_in_bucket(self, tagger, time):
+        (start, end) = tagger.bucket_bounds(time)
+        (first, last) = (bisect_left(self.times, start), bisect_left(self.times, end))
+        if first == last:
+            return None
+        return self.backups[last - 1] if tagger.latest else self.backups[first]
+
+    def pop_expired(self, duration, now):
+        unexpired_from = duration.unexpired_from(now)
+        if unexpired_from is None:
+            return []
+
+        # adding months clamps to the end of the month, so the expired backups need not be the oldest ones
+        last = bisect_left(self.times, unexpired_from)
+        popped = []
+        remaining = []
+        for backup in self.backups[:last]:
+            (popped if duration.is_expired(backup, now) else remaining).append(backup)
+
+        self.backups[:last] = remaining
+        self.times[:last] = [backup.time for backup in remaining]
+        return popped
+
+    def pop_duplicates(self, tagger, start, end):
+        (first, last) = (bisect_left(self.times, start), bisect_left(self.times, end))
+        if last - first < 2:
+            return []
+
+        # keep the backup the tagger prefers, like find_duplicates does
+        keep = last - 1 if tagger.latest else first
+        duplicates = self.backups[first:keep] + self.backups[keep + 1:last]
+        self.backups[first:last] = [self.backups[keep]]
+        self.times[first:last] = [self.times[keep]]
+        return duplicates
+
+_TAGS = (meta.TAG_SNAPSHOT, meta.TAG_HOURLY, meta.TAG_DAILY, meta.TAG_WEEKLY, meta.TAG_MONTHLY, meta.TAG_YEARLY)
+
+def _split_by_group(backups, group_for):
+    """Splits every backup into one entry per group of its worlds, as returned by group_for(world name).
+
+    Each piece is identified by the backup it was split from and the first of its worlds, which no other piece of that
+    backup holds, so the pieces stay distinct in the catalog and keep their ids under any later policy.  Pieces of one
+    backup that fall into the same group, because the policy changed since they were split, are merged back into one
+    entry that keeps the longest lived of their tags.
+    """
+    groups = {}
+    pieces = {}
+    for backup in backups:
+        worlds_by_group = {}
+        for world_meta in backup.worlds:
+            worlds_by_group.setdefault(group_for(world_meta.name), []).append(world_meta)
+
+        if backup.parent_id is None and len(worlds_by_group) <= 1:
+            groups.setdefault(next(iter(worlds_by_group), None), []).append(backup)
+            continue
+
+        parent_id = backup.parent_id or backup.id
+        for (group, worlds) in worlds_by_group.items():
+            pieces.setdefault((parent_id, group), []).append((backup, worlds))
+
+    for ((parent_id, group), parts) in pieces.items():
+        (backup, _) = parts[0]
+        worlds = [world_meta for (_, part_worlds) in parts for world_meta in part_worlds]
+        tag = max((part.tag for (part, _) in parts), key=_TAGS.index)
+        piece_id = "{}/{}".format(parent_id, min(world_meta.name for world_meta in worlds))
+        groups.setdefault(group, []).append(meta.BackupMeta(piece_id, backup.time, backup.archive_format, worlds, tag,
+                                                            parent_id))
+
+    return groups
+
 def _group_backups_by_tag(backups):
     grouped_backups = {
         meta.TAG_SNAPSHOT : set(),
@@ -99,8 +296,8 @@ class RetentionRule(object):
 
         return duplicates
 
-    def is_expired(self, backup):
-        return self.duration.is_expired(backup)
+    def is_expired(self, backup, now=None):
+        return self.duration.is_expired(backup, now)
 
     def is_higher_granularity(self, other):
         if other is None:
@@ -117,15 +314,28 @@ class RetentionRule(object):
 
 
 class BaseDuration(object):
-    def is_expired(self, backup):
+    def is_expired(self, backup, now=None):
         raise NotImplementedError()
 
+    def unexpired_from(self, now):
+        """A time from which no backup has expired at now, or None if no backup ever expires."""
+        raise NotImplementedError()
+
+# adding or subtracting months or years clamps the day to the end of the month, by at most 3 days each way
+_CLAMP_SLACK = datetime.timedelta(days=7)
+
 class Duration(BaseDuration):
     def __init__(self, relative_delta):
         self.relative_delta = relative_delta
 
-    def is_expired(self, backup):
-        return backup.time + self.relative_delta < datetime.datetime.now(tzutc())
+    def is_expired(self, backup, now=None):
+        now = now if now else datetime.datetime.now(datetime.timezone.utc)
+        return backup.time + self.relative_delta < now
+
+    def unexpired_from(self, now):
+        if self.relative_delta.months or self.relative_delta.years:
+            return now - self.relative_delta + _CLAMP_SLACK
+        return now - self.relative_delta
 
     def __eq__(self, other):
         if isinstance(other, Duration):
@@ -137,9 +347,12 @@ class Duration(BaseDuration):
 
 
 class DurationForever(BaseDuration):
-    def is_expired(self, backup):
+    def is_expired(self, backup, now=None):
         return False
 
+    def unexpired_from(self, now):
+        return None
+
     def __eq__(self, other):
         return isinstance(other, DurationForever)
 
@@ -1,8 +1,9 @@
+from functools import lru_cache
 from dateutil.relativedelta import relativedelta
 from .tagger import HourlyTagger, DailyTagger, WeeklyTagger, MonthlyTagger, YearlyTagger, SnapshotTagger
-from .base import RetentionPolicy, RetentionRule, DurationForever, Duration
+from .base import RetentionPolicy, WorldRetentionPolicy, RetentionRule, DurationForever, Duration
 
-__all__ = ["parse", "ParseError"]
+__all__ = ["parse", "parse_worlds", "parse_duration", "ParseError"]
 
 _NORMALIZED_DURATIONS = {
     "second" : "seconds",
@@ -30,8 +31,38 @@ _NAME_TO_TAGGER = {
 }
 
 def parse(rules):
+    # the same rules are parsed for every backup target and every world override, policies are never modified
+    return _parse_rules(tuple(rules))
+
+@lru_cache(maxsize=None)
+def _parse_rules(rules):
     return RetentionPolicy([_parse_rule(i, rule) for i, rule in enumerate(rules, 1) if rule.strip()])
 
+def parse_worlds(rules, world_rules):
+    """Parses the default rules plus a list of [pattern, rule, ...] lists for the worlds matching each pattern."""
+    if not world_rules:
+        return parse(rules)
+
+    overrides = []
+    for world_rule in world_rules:
+        if len(world_rule) < 2:
+            raise ParseError(1, "No rules were specified for the worlds matching '{}'.".format(world_rule[0]))
+        overrides.append((world_rule[0], parse(world_rule[1:])))
+
+    return WorldRetentionPolicy(parse(rules), overrides)
+
+def parse_duration(duration):
+    state = ParserState(duration.lower().split())
+    result = _parse_duration(1, state)
+
+    if state.has_next():
+        prev_token = state.last()
+        next_token = state.next()
+        raise ParseError(1, "Unexpected token {} following {}; expected end of duration.".format(
+            next_token, prev_token))
+
+    return result
+
 def _parse_rule(rule_number, rule):
     state = ParserState(rule.lower().split())
     tagger = _parse_tagger(rule_number, state)
@@ -0,0 +1,248 @@
+import os
+import datetime
+import numpy as np
+from .base import Duration, DurationForever
+from .. import meta
+
+__all__ = ["Timeline", "SimulationResult", "simulate"]
+
+_MICROSECONDS_PER_HOUR = 3600 * 1000000
+_MICROSECONDS_PER_DAY = 24 * _MICROSECONDS_PER_HOUR
+_NEVER = np.iinfo(np.int64).max
+
+class Timeline(object):
+    def __init__(self, times, sizes):
+        order = np.argsort(times, kind='stable')
+        self.times = np.asarray(times, dtype='datetime64[us]')[order]
+        self.sizes = np.asarray(sizes, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def synthetic(cls, start, end, interval, size, growth=0):
+        interval = _fixed_microseconds(interval)
+        start = np.datetime64(_naive_utc(start), 'us').astype(np.int64)
+        end = np.datetime64(_naive_utc(end), 'us').astype(np.int64)
+
+        times = np.arange(start, end, interval, dtype=np.int64)
+        elapsed_days = (times - start) / _MICROSECONDS_PER_DAY
+        sizes = np.int64(size) + (elapsed_days * growth).astype(np.int64)
+        return cls(times.astype('datetime64[us]'), sizes)
+
+    @classmethod
+    def recorded(cls, backup_dir, default_size=0):
+        times = []
+        sizes = []
+        for backup_meta in meta.load_meta(backup_dir):
+            times.append(np.datetime64(_naive_utc(backup_meta.time), 'us'))
+
+            size = 0
+            for world_meta in backup_meta.worlds:
+                for path in world_meta.paths:
+                    world_path = os.path.join(backup_dir, path)
+                    size += os.path.getsize(world_path) if os.path.exists(world_path) else default_size
+            sizes.append(size)
+
+        return cls(np.array(times, dtype='datetime64[us]'), np.array(sizes, dtype=np.int64))
+
+class SimulationResult(object):
+    def __init__(self, sample_times, counts, total_count, total_bytes):
+        self.sample_times = sample_times
+        self.counts = counts
+        self.total_count = total_count
+        self.total_bytes = total_bytes
+
+    def __repr__(self):
+        return "SimulationResult{{samples={},peak_count={},peak_bytes={}}}".format(
+            len(self.sample_times), self.total_count.max(initial=0), self.total_bytes.max(initial=0))
+
+# the simulator decides once, over the whole timeline, which backup of each bucket a rule keeps.  apply() decides on
+# every run and elects another backup of a bucket once the one it kept is purged, e.g. "oldest monthly keep 1 week"
+# keeps a second backup of the month after the first expires.  simulate() checks every decision against the rule
+# apply() uses and raises ValueError for policies where they differ, rather than report counts apply() never reaches
+def simulate(policy, timeline, sample_times=None):
+    times = timeline.times.astype(np.int64)
+    if sample_times is None:
+        sample_times = times
+    sample_times = np.asarray(sample_times, dtype='datetime64[us]')
+    samples = sample_times.astype(np.int64)
+
+    # retention is only applied when a backup runs, so every transition happens at the time of a backup
+    members = np.arange(len(times))
+    enter = times.copy()
+    final_exit = np.full(len(times), _NEVER, dtype=np.int64)
+    counts = {}
+    retags = []
+
+    rules = policy.rules if policy.rules and policy.rules[0].tag == meta.TAG_SNAPSHOT else []
+    for (i, rule) in enumerate(rules):
+        if i > 0:
+            # a backup leaving the previous rule is retagged when it is the latest (or oldest) of its bucket,
+            # otherwise the previous rule purges it
+            representatives = _bucket_representatives(_grouping_keys(rule.tag, times[members]), rule.tagger.latest)
+            moving = leave < _NEVER
+            representatives[moving] &= ~_blocked(rule, times, members[moving], leave[moving], final_exit)
+            final_exit[members[moving & ~representatives]] = leave[moving & ~representatives]
+            retags.append((i, rule, members[moving], leave[moving], representatives[moving]))
+
+            members = members[moving & representatives]
+            enter = leave[moving & representatives]
+
+        leave = np.maximum(enter, _first_run_after(times, _expiry(rule.duration, times[members])))
+        counts[rule.tag] = _count_alive(enter, leave, samples)
+
+    if rules:
+        final_exit[members] = leave
+    else:
+        counts[meta.TAG_SNAPSHOT] = _count_alive(times, final_exit, samples)
+
+    for (i, rule, candidates, leave, retagged) in retags:
+        elected = _elected(rule, times, candidates, leave, final_exit)
+        differ = elected != retagged
+        (candidates, leave, elected) = (candidates[differ], leave[differ], elected[differ])
+
+        # a backup that is retagged and purged again in the same run never shows, whichever way it was decided
+        unseen = (final_exit[candidates] == leave) & \
+            (~elected | _passes_through(rules, i, times, candidates, leave, final_exit))
+        if not np.all(unseen):
+            raise ValueError("Rule #{}: the policy elects another {} backup of a bucket once the one it kept is "
+                             "purged, which the simulator does not model".format(i + 1, rule.tag))
+
+    total_count = _count_alive(times, final_exit, samples)
+    total_bytes = _count_alive(times, final_exit, samples, timeline.sizes)
+    return SimulationResult(sample_times, counts, total_count, total_bytes)
+
+def _grouping_keys(tag, times):
+    if tag == meta.TAG_SNAPSHOT:
+        return times
+    elif tag == meta.TAG_HOURLY:
+        return times // _MICROSECONDS_PER_HOUR
+    elif tag == meta.TAG_DAILY:
+        return times // _MICROSECONDS_PER_DAY
+    elif tag == meta.TAG_WEEKLY:
+        # the epoch was a Thursday, shifting by three days makes weeks start on the ISO Monday
+        return (times // _MICROSECONDS_PER_DAY + 3) // 7
+    elif tag == meta.TAG_MONTHLY:
+        return times.astype('datetime64[us]').astype('datetime64[M]').astype(np.int64)
+    elif tag == meta.TAG_YEARLY:
+        return times.astype('datetime64[us]').astype('datetime64[Y]').astype(np.int64)
+
+    raise ValueError("Unsupported tag {}".format(tag))
+
+def _bucket_representatives(keys, latest):
+    # times are sorted, so every bucket is a contiguous run of equal keys
+    boundaries = keys[1:] != keys[:-1]
+    if latest:
+        return np.concatenate([boundaries, [True]]) if len(keys) else np.zeros(0, dtype=bool)
+    return np.concatenate([[True], boundaries]) if len(keys) else np.zeros(0, dtype=bool)
+
+def _blocked(rule, times, candidates, leave, final_exit):
+    # the policy compares against every backup that still exists, including newer ones that have not
+    # reached the previous rule yet, so check the latest (or oldest) backup of the bucket created by then
+    keys = _grouping_keys(rule.tag, times)
+    if rule.tagger.latest:
+        bucket_end = np.searchsorted(keys, keys[candidates], side='right')
+        other = np.minimum(np.searchsorted(times, leave, side='right'), bucket_end) - 1
+        return (other > candidates) & (final_exit[other] >= leave)
+
+    other = np.searchsorted(keys, keys[candidates], side='left')
+    return (other < candidates) & (final_exit[other] >= leave)
+
+def _elected(rule, times, candidates, leave, final_exit):
+    # what apply() decides when each candidate leaves the previous rule: it is retagged unless an older (or newer)
+    # backup of its bucket still exists at that run.  If every decision agrees with the simulated ones, the
+    # simulation is the same sequence of states apply() goes through
+    (bucket_starts, bucket_ends) = _bucket_bounds(_grouping_keys(rule.tag, times))
+    if rule.tagger.latest:
+        (starts, ends) = (candidates + 1, np.minimum(bucket_ends[candidates],
+                                                     np.searchsorted(times, leave, side='right')))
+    else:
+        (starts, ends) = (bucket_starts[candidates], candidates)
+
+    # usually the first backup of the range is the one that still holds the bucket, only the rest need a range query
+    held = (starts < ends) & (final_exit[starts.clip(max=len(times) - 1)] >= leave)
+    rest = (starts < ends) & ~held
+    held[rest] = _range_max(final_exit, starts[rest], ends[rest]) >= leave[rest]
+    return ~held
+
+def _bucket_bounds(keys):
+    # times are sorted, so every bucket is a contiguous run of equal keys
+    index = np.arange(len(keys))
+    boundaries = np.concatenate([[True], keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=bool)
+    starts = np.maximum.accumulate(np.where(boundaries, index, 0))
+    ends = np.concatenate([index[boundaries][1:], [len(keys)]])[np.cumsum(boundaries) - 1]
+    return (starts, ends)
+
+def _passes_through(rules, i, times, candidates, leave, final_exit):
+    # whether backups retagged by rule i when they leave the previous rule are purged again in that same run
+    through = _first_run_after(times, _expiry(rules[i].duration, times[candidates])) <= leave
+    if i + 1 < len(rules):
+        through &= ~_elected(rules[i + 1], times, candidates, leave, final_exit) | \
+            _passes_through(rules, i + 1, times, candidates, leave, final_exit)
+    return through
+
+def _range_max(values, starts, ends):
+    # a sparse table built one level at a time, level k holds the maximum of every values[j:j + 2**k]
+    result = np.full(len(starts), np.iinfo(np.int64).min, dtype=np.int64)
+    lengths = np.maximum(ends - starts, 0)
+    levels = np.frexp(lengths)[1] - 1
+
+    table = values
+    for level in range(int(levels.max(initial=-1)) + 1):
+        at = levels == level
+        result[at] = np.maximum(table[starts[at]], table[ends[at] - (1 << level)])
+        table = np.maximum(table[:-(1 << level)], table[1 << level:])
+
+    return result
+
+def _expiry(duration, times):
+    if isinstance(duration, DurationForever):
+        return np.full(len(times), _NEVER, dtype=np.int64)
+
+    if not isinstance(duration, Duration):
+        raise ValueError("Unsupported duration {}".format(duration))
+
+    delta = duration.relative_delta
+    months = delta.years * 12 + delta.months
+    if months:
+        # relativedelta keeps the day of the month, clamped to the length of the target month
+        datetimes = times.astype('datetime64[us]')
+        days = datetimes.astype('datetime64[D]')
+        month = datetimes.astype('datetime64[M]')
+        day_of_month = days - month.astype('datetime64[D]')
+        target = month + months
+        month_length = (target + 1).astype('datetime64[D]') - target.astype('datetime64[D]')
+        target_days = target.astype('datetime64[D]') + np.minimum(day_of_month, month_length - 1)
+        times = (target_days.astype('datetime64[us]') + (datetimes - days)).astype(np.int64)
+
+    return times + _fixed_microseconds(delta, allow_months=True)
+
+def _first_run_after(times, expiry):
+    index = np.searchsorted(times, expiry, side='right')
+    return np.where(index < len(times), times[np.minimum(index, len(times) - 1)], _NEVER)
+
+def _count_alive(enter, leave, samples, weights=None):
+    enter_order = np.argsort(enter, kind='stable')
+    exit_order = np.argsort(leave, kind='stable')
+    entered = np.searchsorted(enter[enter_order], samples, side='right')
+    exited = np.searchsorted(leave[exit_order], samples, side='right')
+
+    if weights is None:
+        return entered - exited
+
+    entered_weight = np.concatenate([[0], np.cumsum(weights[enter_order])])
+    exited_weight = np.concatenate([[0], np.cumsum(weights[exit_order])])
+    return entered_weight[entered] - exited_weight[exited]
+
+def _fixed_microseconds(delta, allow_months=False):
+    if not allow_months and (delta.years or delta.months):
+        raise ValueError("Durations of months or years do not have a fixed length")
+
+    return ((((delta.days * 24 + delta.hours) * 60 + delta.minutes) * 60 + delta.seconds) * 1000000 +
+            delta.microseconds)
+
+def _naive_utc(time):
+    if time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return time
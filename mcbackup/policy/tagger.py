@@ -1,5 +1,6 @@
-import isoweek
 import operator
+import datetime
+from dateutil.relativedelta import relativedelta
 from .. import meta
 
 __all__ = ["Tagger", "SnapshotTagger", "MonthlyTagger", "HourlyTagger", "DailyTagger", "WeeklyTagger",
@@ -37,6 +38,10 @@ class Tagger(object):
     def _grouping_key(self, backup):
         raise NotImplementedError()
 
+    def bucket_bounds(self, time):
+        # the half open range of times that share the grouping key of time
+        raise NotImplementedError()
+
     def is_higher_granularity(self, other):
         return self.ordinal > other.ordinal
 
@@ -62,6 +67,9 @@ class SnapshotTagger(Tagger):
     def _grouping_key(self, backup):
         return backup.time
 
+    def bucket_bounds(self, time):
+        return (time, time + datetime.timedelta(microseconds=1))
+
 class HourlyTagger(Tagger):
     def __init__(self, latest=True):
         super(HourlyTagger, self).__init__(meta.TAG_HOURLY, 10, True, latest)
@@ -69,6 +77,10 @@ class HourlyTagger(Tagger):
     def _grouping_key(self, backup):
         return backup.time.replace(minute=0, second=0, microsecond=0)
 
+    def bucket_bounds(self, time):
+        start = time.replace(minute=0, second=0, microsecond=0)
+        return (start, start + relativedelta(hours=1))
+
 class DailyTagger(Tagger):
     def __init__(self, latest=True):
         super(DailyTagger, self).__init__(meta.TAG_DAILY, 20, True, latest)
@@ -76,14 +88,22 @@ class DailyTagger(Tagger):
     def _grouping_key(self, backup):
         return backup.time.date()
 
+    def bucket_bounds(self, time):
+        start = time.replace(hour=0, minute=0, second=0, microsecond=0)
+        return (start, start + relativedelta(days=1))
+
 class WeeklyTagger(Tagger):
     def __init__(self, latest=True):
         super(WeeklyTagger, self).__init__(meta.TAG_WEEKLY, 30, True, latest)
 
     def _grouping_key(self, backup):
-        (year, week, _) = backup.time.isocalendar()
+        # the monday starting the ISO week
+        date = backup.time.date()
+        return date - datetime.timedelta(days=date.weekday())
 
-        return isoweek.Week(year, week).monday()
+    def bucket_bounds(self, time):
+        start = time.replace(hour=0, minute=0, second=0, microsecond=0) - relativedelta(days=time.weekday())
+        return (start, start + relativedelta(weeks=1))
 
 class MonthlyTagger(Tagger):
     def __init__(self, latest=True):
@@ -92,9 +112,17 @@ class MonthlyTagger(Tagger):
     def _grouping_key(self, backup):
         return backup.time.date().replace(day=1)
 
+    def bucket_bounds(self, time):
+        start = time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return (start, start + relativedelta(months=1))
+
 class YearlyTagger(Tagger):
     def __init__(self, latest=True):
         super(YearlyTagger, self).__init__(meta.TAG_YEARLY, 50, True, latest)
 
     def _grouping_key(self, backup):
         return backup.time.date().replace(month=1, day=1)
+
+    def bucket_bounds(self, time):
+        start = time.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        return (start, start + relativedelta(years=1))
@@ -0,0 +1,141 @@
+import os
+import mmap
+from collections import deque
+
+__all__ = ['PipelinedReader', 'SynchronousReader', 'FileData', 'resident_fraction']
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_BUFFERED = 64 * 1024 * 1024
+DEFAULT_MAX_FILE_SIZE = 16 * 1024 * 1024
+
+class FileData(object):
+    def __init__(self, full_path, archive_name, data=None, drop_cache=False):
+        self.full_path = full_path
+        self.archive_name = archive_name
+        self.data = data
+        self.drop_cache = drop_cache
+
+    def release(self):
+        # files too large to buffer are read by the archiver itself, so their pages can only be dropped afterwards
+        if self.data is None and self.drop_cache:
+            _drop_cache(self.full_path)
+        self.data = None
+
+class SynchronousReader(object):
+    def read(self, files):
+        for (full_path, archive_name) in files:
+            yield FileData(full_path, archive_name)
+
+class PipelinedReader(object):
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_buffered=DEFAULT_MAX_BUFFERED,
+                 max_file_size=DEFAULT_MAX_FILE_SIZE, drop_cache=True):
+        self.max_workers = max_workers
+        self.max_buffered = max_buffered
+        self.max_file_size = max_file_size
+        self.drop_cache = drop_cache
+
+    def read(self, files):
+        from concurrent.futures import ThreadPoolExecutor
+
+        pending = deque()
+        buffered = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for (full_path, archive_name) in files:
+                size = os.path.getsize(full_path)
+
+                # never let the read-ahead hold more than max_buffered bytes waiting on the compressor
+                while pending and buffered + size > self.max_buffered:
+                    (future, pending_size) = pending.popleft()
+                    buffered -= pending_size
+                    yield future.result()
+
+                pending.append((executor.submit(self._read_file, full_path, archive_name, size), size))
+                buffered += size
+
+            while pending:
+                (future, _) = pending.popleft()
+                yield future.result()
+
+    def _read_file(self, full_path, archive_name, size):
+        with open(full_path, 'rb') as file:
+            fd = file.fileno()
+            drop_cache = self.drop_cache and not _is_resident(fd, size)
+
+            _fadvise(fd, 'POSIX_FADV_SEQUENTIAL')
+            _fadvise(fd, 'POSIX_FADV_WILLNEED')
+            if size > self.max_file_size:
+                return FileData(full_path, archive_name, drop_cache=drop_cache)
+
+            data = file.read()
+            if drop_cache:
+                _fadvise(fd, 'POSIX_FADV_DONTNEED')
+
+        return FileData(full_path, archive_name, data)
+
+def _fadvise(fd, advice):
+    if hasattr(os, 'posix_fadvise') and hasattr(os, advice):
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+        except OSError:
+            pass
+
+def _drop_cache(full_path):
+    try:
+        with open(full_path, 'rb') as file:
+            _fadvise(file.fileno(), 'POSIX_FADV_DONTNEED')
+    except OSError:
+        pass
+
+_libc = None
+def _mincore():
+    global _libc
+    if _libc is None:
+        try:
+            import ctypes.util
+            _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            _libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+        except (OSError, AttributeError, TypeError):
+            _libc = False
+
+    return _libc.mincore if _libc else None
+
+def _resident_pages(fd, size):
+    mincore = _mincore()
+    if mincore is None or size == 0:
+        return None
+
+    try:
+        mapping = mmap.mmap(fd, size, access=mmap.ACCESS_COPY)
+    except (OSError, ValueError):
+        return None
+
+    import ctypes
+    try:
+        buffer = ctypes.c_char.from_buffer(mapping)
+        pages = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+        vector = (ctypes.c_ubyte * pages)()
+        result = mincore(ctypes.c_void_p(ctypes.addressof(buffer)), size, vector)
+        # the mapping cannot be closed while ctypes still holds a reference into it
+        del buffer
+        if result != 0:
+            return None
+
+        return (pages - bytes(vector).count(0), pages)
+    finally:
+        mapping.close()
+
+def _is_resident(fd, size):
+    # files the server already holds in the page cache are left there; only pages the backup pulled in are dropped
+    resident = _resident_pages(fd, size)
+    return resident is not None and resident[0] == resident[1]
+
+def resident_fraction(full_path):
+    with open(full_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        resident = _resident_pages(file.fileno(), size)
+
+    if resident is None:
+        return 0.0 if size else 1.0
+
+    return resident[0] / resident[1]
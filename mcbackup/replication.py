@@ -0,0 +1,353 @@
+import os
+import json
+import fcntl
+import base64
+import hashlib
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from . import meta
+from .defaults import DEFAULT_PART_SIZE, DEFAULT_MAX_WORKERS
+
+__all__ = ['S3Replicator', 'ReplicationError', 'parse_s3_url']
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+_STATE_FILE = "replication.json"
+_STATE_LOCK = "replication.lock"
+
+def parse_s3_url(url):
+    parsed = urlparse(url)
+    if parsed.scheme != 's3' or not parsed.netloc:
+        raise ValueError("The replication target {} is not a valid s3://bucket/prefix url".format(url))
+
+    return (parsed.netloc, parsed.path.strip('/'))
+
+class ReplicationError(Exception):
+    pass
+
+class S3Replicator(object):
+    def __init__(self, bucket, prefix='', endpoint_url=None, part_size=DEFAULT_PART_SIZE,
+                 max_workers=DEFAULT_MAX_WORKERS, client=None):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError("The multipart part size must be at least {} bytes".format(MIN_PART_SIZE))
+
+        if max_workers < 1:
+            raise ValueError("At least one replication worker is required")
+
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.endpoint_url = endpoint_url
+        self.part_size = part_size
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        (bucket, prefix) = parse_s3_url(url)
+        return cls(bucket, prefix, **kwargs)
+
+    def part_size_for(self, size):
+        # object stores reject uploads of more than MAX_PARTS parts, so very large archives need larger parts
+        mebibyte = 1024 * 1024
+        required = (size + MAX_PARTS - 1) // MAX_PARTS
+        required = (required + mebibyte - 1) // mebibyte * mebibyte
+        return max(self.part_size, required)
+
+    @property
+    def destination(self):
+        return "{}|s3://{}/{}".format(self.endpoint_url or '', self.bucket, self.prefix)
+
+    def replicate(self, backup_dir, meta_data):
+        from concurrent.futures import ThreadPoolExecutor
+
+        state = ReplicationState.load(backup_dir, self.destination)
+
+        local_paths = set()
+        for backup_meta in meta_data:
+            for world_meta in backup_meta.worlds:
+                local_paths.update(world_meta.paths)
+
+        # archives first so the remote catalog never references an object that has not been uploaded yet
+        pending = [path for path in sorted(local_paths) if state.is_stale(path, os.path.join(backup_dir, path))]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            uploads = [self._start_upload(executor, state, backup_dir, path) for path in pending]
+
+            errors = []
+            for upload in uploads:
+                try:
+                    upload.finish()
+                except Exception as e:
+                    errors.append("{}: {}".format(upload.path, e))
+
+        if errors:
+            raise ReplicationError("Failed to replicate {} archive(s) to {}:\n\t{}".format(
+                len(errors), self.destination, "\n\t".join(errors)))
+
+        for catalog_path in meta.catalog_files(backup_dir):
+            with open(catalog_path, 'rb') as file:
+                self._put_object(self._key(os.path.relpath(catalog_path, backup_dir)), file.read())
+
+        # mirror purges from the retention policy, including any left over by an earlier failed run
+        with state.locked():
+            for path in sorted(state.remote_paths() - local_paths):
+                print ("Deleting replicated backup {}".format(self._key(path)))
+                pending = state.uploads.get(path)
+                if pending is not None:
+                    self.client.abort_multipart_upload(Bucket=self.bucket, Key=self._key(path),
+                                                       UploadId=pending['upload_id'])
+                self.client.delete_object(Bucket=self.bucket, Key=self._key(path))
+                state.forget(path)
+
+    def _start_upload(self, executor, state, backup_dir, path):
+        full_path = os.path.join(backup_dir, path)
+        file_stat = os.stat(full_path)
+
+        print ("Replicating {} to s3://{}/{}".format(full_path, self.bucket, self._key(path)))
+        if file_stat.st_size <= self.part_size:
+            upload = _SingleUpload(self, state, path, full_path, file_stat)
+        else:
+            upload = _MultipartUpload(self, state, path, full_path, file_stat)
+
+        upload.submit(executor)
+        return upload
+
+    def _put_object(self, key, data):
+        digest = hashlib.md5(data).digest()
+        response = self.client.put_object(Bucket=self.bucket, Key=key, Body=data,
+                                          ContentMD5=base64.b64encode(digest).decode('ascii'))
+        _verify_etag(key, response['ETag'], digest.hex())
+
+    def _key(self, path):
+        key = path.replace(os.sep, '/')
+        return "{}/{}".format(self.prefix, key) if self.prefix else key
+
+class _SingleUpload(object):
+    def __init__(self, replicator, state, path, full_path, file_stat):
+        self.replicator = replicator
+        self.state = state
+        self.path = path
+        self.full_path = full_path
+        self.file_stat = file_stat
+        self.future = None
+
+    def submit(self, executor):
+        self.future = executor.submit(self._upload)
+
+    def _upload(self):
+        with open(self.full_path, 'rb') as file:
+            data = file.read()
+
+        self.replicator._put_object(self.replicator._key(self.path), data)
+        self.state.uploaded(self.path, self.file_stat)
+
+    def finish(self):
+        self.future.result()
+
+class _MultipartUpload(object):
+    def __init__(self, replicator, state, path, full_path, file_stat):
+        self.replicator = replicator
+        self.client = replicator.client
+        self.bucket = replicator.bucket
+        self.key = replicator._key(path)
+        self.state = state
+        self.path = path
+        self.full_path = full_path
+        self.file_stat = file_stat
+        self.part_size = replicator.part_size_for(file_stat.st_size)
+        self.futures = []
+
+    @property
+    def part_count(self):
+        return (self.file_stat.st_size + self.part_size - 1) // self.part_size
+
+    def submit(self, executor):
+        (self.upload_id, parts) = self._resume_or_create()
+        self.parts = parts
+
+        for part_number in range(1, self.part_count + 1):
+            if part_number not in parts:
+                self.futures.append(executor.submit(self._upload_part, part_number))
+
+    def _resume_or_create(self):
+        pending = self.state.pending_upload(self.path, self.file_stat, self.part_size)
+        if pending is not None:
+            upload_id = pending['upload_id']
+            try:
+                remote_parts = self._list_parts(upload_id)
+            except self.client.exceptions.ClientError:
+                remote_parts = None
+
+            if remote_parts is not None:
+                # only trust parts that the object store and the local state agree on
+                parts = {}
+                for (part_number, part) in pending['parts'].items():
+                    if remote_parts.get(part_number) == part['etag']:
+                        parts[part_number] = part
+
+                print ("Resuming upload of {} with {} of {} parts already uploaded".format(
+                    self.key, len(parts), self.part_count))
+                return (upload_id, parts)
+
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+        upload_id = response['UploadId']
+        self.state.started(self.path, self.file_stat, self.part_size, upload_id)
+        return (upload_id, {})
+
+    def _list_parts(self, upload_id):
+        remote_parts = {}
+        kwargs = {'Bucket' : self.bucket, 'Key' : self.key, 'UploadId' : upload_id}
+        while True:
+            response = self.client.list_parts(**kwargs)
+            for part in response.get('Parts', []):
+                remote_parts[part['PartNumber']] = part['ETag']
+
+            if not response.get('IsTruncated'):
+                return remote_parts
+
+            kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+    def _upload_part(self, part_number):
+        with open(self.full_path, 'rb') as file:
+            file.seek((part_number - 1) * self.part_size)
+            data = file.read(self.part_size)
+
+        digest = hashlib.md5(data).digest()
+        response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                           PartNumber=part_number, Body=data,
+                                           ContentMD5=base64.b64encode(digest).decode('ascii'))
+        _verify_etag("{} part {}".format(self.key, part_number), response['ETag'], digest.hex())
+
+        part = {'etag' : response['ETag'], 'md5' : digest.hex()}
+        self.parts[part_number] = part
+        self.state.part_uploaded(self.path, part_number, part)
+
+    def finish(self):
+        for future in self.futures:
+            future.result()
+
+        part_numbers = sorted(self.parts.keys())
+        response = self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts' : [{'PartNumber' : n, 'ETag' : self.parts[n]['etag']} for n in part_numbers]})
+
+        combined = hashlib.md5(b''.join(bytes.fromhex(self.parts[n]['md5']) for n in part_numbers))
+        _verify_etag(self.key, response['ETag'], "{}-{}".format(combined.hexdigest(), len(part_numbers)))
+        self.state.uploaded(self.path, self.file_stat)
+
+def _verify_etag(name, etag, expected):
+    if etag.strip('"') != expected:
+        raise ReplicationError("Checksum mismatch for {}: expected {}, object store returned {}".format(
+            name, expected, etag))
+
+class ReplicationState(object):
+    def __init__(self, state_path, destination, objects=None, uploads=None):
+        self.state_path = state_path
+        self.lock_path = os.path.join(os.path.dirname(state_path), _STATE_LOCK)
+        self.destination = destination
+        self.objects = objects if objects else {}
+        self.uploads = uploads if uploads else {}
+        self.lock = threading.RLock()
+        self._lock_file = None
+
+    @classmethod
+    def load(cls, backup_dir, destination):
+        state_path = os.path.join(backup_dir, _STATE_FILE)
+        return cls(state_path, destination, *_read_state(state_path, destination))
+
+    def is_stale(self, path, full_path):
+        remote = self.objects.get(path)
+        if remote is None:
+            return True
+
+        file_stat = os.stat(full_path)
+        return remote['size'] != file_stat.st_size or remote['mtime'] != file_stat.st_mtime
+
+    def remote_paths(self):
+        return set(self.objects.keys()) | set(self.uploads.keys())
+
+    def pending_upload(self, path, file_stat, part_size):
+        upload = self.uploads.get(path)
+        if upload is None or upload['size'] != file_stat.st_size or upload['mtime'] != file_stat.st_mtime or \
+                upload['part_size'] != part_size:
+            return None
+
+        return upload
+
+    def started(self, path, file_stat, part_size, upload_id):
+        with self.locked():
+            self.uploads[path] = {'upload_id' : upload_id, 'size' : file_stat.st_size, 'mtime' : file_stat.st_mtime,
+                                  'part_size' : part_size, 'parts' : {}}
+            self._save(path)
+
+    def part_uploaded(self, path, part_number, part):
+        with self.locked():
+            self.uploads[path]['parts'][part_number] = part
+            self._save(path)
+
+    def uploaded(self, path, file_stat):
+        with self.locked():
+            self.uploads.pop(path, None)
+            self.objects[path] = {'size' : file_stat.st_size, 'mtime' : file_stat.st_mtime}
+            self._save(path)
+
+    def forget(self, path):
+        with self.locked():
+            self.uploads.pop(path, None)
+            self.objects.pop(path, None)
+            self._save(path)
+
+    @contextmanager
+    def locked(self):
+        # the threads of this run share the state, other runs against the same backup dir share the file
+        with self.lock:
+            if self._lock_file is not None:
+                yield
+                return
+
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._lock_file = lock_file
+                try:
+                    yield
+                finally:
+                    self._lock_file = None
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _save(self, path):
+        # only the entry for path is ours, everything else is whatever other runs have written since we loaded
+        (objects, uploads) = _read_state(self.state_path, self.destination)
+        for (ours, stored) in ((self.objects, objects), (self.uploads, uploads)):
+            if path in ours:
+                stored[path] = ours[path]
+            else:
+                stored.pop(path, None)
+
+        tmp_path = "{}.{}.tmp".format(self.state_path, os.getpid())
+        with open(tmp_path, 'w') as file:
+            json.dump({'destination' : self.destination, 'objects' : objects, 'uploads' : uploads}, file)
+
+        os.replace(tmp_path, self.state_path)
+
+def _read_state(state_path, destination):
+    if not os.path.exists(state_path):
+        return ({}, {})
+
+    with open(state_path, 'r') as file:
+        data = json.load(file)
+
+    # a different destination starts from scratch rather than trusting another bucket's state
+    if data.get('destination') != destination:
+        return ({}, {})
+
+    uploads = {}
+    for (path, upload) in data.get('uploads', {}).items():
+        upload['parts'] = {int(n) : part for (n, part) in upload['parts'].items()}
+        uploads[path] = upload
+
+    return (data.get('objects', {}), uploads)
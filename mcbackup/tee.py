@@ -0,0 +1,104 @@
+import io
+import queue
+import threading
+
+__all__ = ['TeeWriter', 'TeeError']
+
+DEFAULT_MAX_PENDING = 64
+DEFAULT_STALL_TIMEOUT = 60
+
+_CLOSE = object()
+
+class TeeError(IOError):
+    pass
+
+class TeeWriter(io.RawIOBase):
+    def __init__(self, files, max_pending=DEFAULT_MAX_PENDING, stall_timeout=DEFAULT_STALL_TIMEOUT):
+        super(TeeWriter, self).__init__()
+        self.stall_timeout = stall_timeout
+        self.sinks = [_Sink(name, file, max_pending) for (name, file) in files]
+
+        for sink in self.sinks:
+            sink.start()
+
+    @property
+    def failures(self):
+        return {sink.destination : sink.error for sink in self.sinks if sink.error is not None}
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        # the caller is free to reuse its buffer once write returns so every sink gets its own copy
+        data = bytes(data)
+
+        live_sinks = [sink for sink in self.sinks if sink.error is None]
+        if not live_sinks:
+            raise TeeError("All destinations failed: {}".format(self.failures))
+
+        for sink in live_sinks:
+            try:
+                sink.queue.put(data, timeout=self.stall_timeout)
+            except queue.Full:
+                self._stalled(sink)
+
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+
+        # a stalled sink is stuck in its destination's write, it is abandoned rather than waited for
+        for sink in self.sinks:
+            if sink.stalled:
+                continue
+            try:
+                sink.queue.put(_CLOSE, timeout=self.stall_timeout)
+            except queue.Full:
+                self._stalled(sink)
+
+        for sink in self.sinks:
+            if sink.stalled:
+                continue
+            sink.join(self.stall_timeout)
+            if sink.is_alive():
+                self._stalled(sink)
+
+        super(TeeWriter, self).close()
+
+    def _stalled(self, sink):
+        sink.stalled = True
+        sink.fail(TeeError("Destination stalled for more than {} seconds".format(self.stall_timeout)))
+
+class _Sink(threading.Thread):
+    def __init__(self, name, file, max_pending):
+        super(_Sink, self).__init__(name="tee-{}".format(name), daemon=True)
+        self.destination = name
+        self.file = file
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.stalled = False
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is _CLOSE:
+                break
+
+            # keep draining after a failure so the writer never blocks on a dead destination
+            if self.error is not None:
+                continue
+
+            try:
+                self.file.write(data)
+            except Exception as e:
+                self.fail(e)
+
+        try:
+            self.file.close()
+        except Exception as e:
+            self.fail(e)
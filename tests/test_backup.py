@@ -0,0 +1,322 @@
+import io
+import os
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import threading
+from nose.tools import eq_, raises, with_setup
+
+from .context import mcbackup
+from mcbackup import meta
+from mcbackup.archiver import DEFINITIONS
+from mcbackup.backup import backup, backup_to_targets, BackupTarget, BackupError, WorldBackup
+from mcbackup.policy import parser
+from mcbackup.tee import TeeWriter
+from mcbackup.reader import PipelinedReader
+from mcbackup.checkpoint import CheckpointedWorldBackup
+
+_tmp_dir = None
+
+def _setup_tmp_dir():
+    global _tmp_dir
+    _tmp_dir = tempfile.mkdtemp()
+
+def _teardown_tmp_dir():
+    shutil.rmtree(_tmp_dir)
+
+def test_tee_writer():
+    first = _Destination()
+    second = _Destination()
+
+    tee = TeeWriter([("first", first), ("second", second)], max_pending=2)
+    for i in range(100):
+        tee.write("chunk{};".format(i).encode('ascii'))
+    tee.close()
+
+    expected = b"".join("chunk{};".format(i).encode('ascii') for i in range(100))
+    eq_(first.contents, expected)
+    eq_(second.contents, expected)
+    eq_(tee.failures, {})
+
+def test_tee_writer_isolates_failed_destination():
+    healthy = _Destination()
+    broken = _Destination(fail_after=3)
+
+    tee = TeeWriter([("healthy", healthy), ("broken", broken)], max_pending=2)
+    for i in range(100):
+        tee.write(b"data")
+    tee.close()
+
+    eq_(healthy.contents, b"data" * 100)
+    eq_(list(tee.failures.keys()), ["broken"])
+
+def test_tee_writer_abandons_stalled_destination():
+    healthy = _Destination()
+    hanging = _Destination(hang_after=1)
+
+    tee = TeeWriter([("healthy", healthy), ("hanging", hanging)], max_pending=2, stall_timeout=0.5)
+    for i in range(10):
+        tee.write(b"data")
+
+    closer = threading.Thread(target=tee.close, daemon=True)
+    closer.start()
+    closer.join(5)
+    hanging.release.set()
+
+    assert not closer.is_alive(), "close() waited for the stalled destination"
+    eq_(healthy.contents, b"data" * 10)
+    eq_(list(tee.failures.keys()), ["hanging"])
+
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_pipelined_reader():
+    files = []
+    for i in range(20):
+        full_path = os.path.join(_tmp_dir, "file{}".format(i))
+        with open(full_path, 'wb') as file:
+            file.write(os.urandom(i * 1024))
+        files.append((full_path, "world/file{}".format(i)))
+
+    # a tiny buffer and file size limit exercise both the buffered and the pass-through paths
+    reader = PipelinedReader(max_workers=3, max_buffered=8 * 1024, max_file_size=10 * 1024)
+    read_files = list(reader.read(files))
+
+    eq_([file_data.archive_name for file_data in read_files], [archive_name for (_, archive_name) in files])
+    for (i, file_data) in enumerate(read_files):
+        if i * 1024 > 10 * 1024:
+            eq_(file_data.data, None)
+        else:
+            with open(file_data.full_path, 'rb') as file:
+                eq_(file_data.data, file.read())
+
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_world_backup_formats():
+    world_dir = _create_worlds("world")
+    reader = PipelinedReader(max_file_size=32 * 1024)
+
+    for (archive_format, archiver) in DEFINITIONS.items():
+        output_file = os.path.join(_tmp_dir, "world.{}".format(archiver.default_ext))
+        WorldBackup(os.path.join(world_dir, "world"), archiver, output_file, reader).run()
+
+        eq_(_read_archive(output_file, archive_format), _read_world(world_dir, "world"))
+
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_backup():
+    world_dir = _create_worlds("world", "world_nether")
+    backup_dir = os.path.join(_tmp_dir, "backups")
+    retention_policy = parser.parse(["keep 7 days"])
+
+    backup(world_dir, ["world"], backup_dir, "{world}-{now:%H%M%S%f}.{ext}", 'tar|gz', retention_policy)
+
+    meta_data = meta.load_meta(backup_dir)
+    eq_([world_meta.name for backup_meta in meta_data for world_meta in backup_meta.worlds], ["world"])
+    with open(meta.Catalog(backup_dir).retention_path, 'r') as file:
+        eq_(file.read(), repr(retention_policy))
+
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_backup_fan_out():
+    world_dir = _create_worlds("world", "world_nether")
+    targets = [BackupTarget(os.path.join(_tmp_dir, "primary"), parser.parse(["keep 7 days"])),
+               BackupTarget(os.path.join(_tmp_dir, "mirror"), parser.parse(["keep 1 day"]))]
+
+    for format in ['tar|gz', 'zip']:
+        backup_to_targets(world_dir, [], targets, "{world}-{now:%H%M%S%f}.{ext}", format)
+
+    for target in targets:
+        meta_data = meta.load_meta(target.backup_dir)
+        eq_(len(meta_data), 2)
+
+        for backup_meta in meta_data:
+            eq_(sorted(world.name for world in backup_meta.worlds), ["world", "world_nether"])
+            for world_meta in backup_meta.worlds:
+                archive_path = os.path.join(target.backup_dir, world_meta.path)
+                eq_(_list_archive(archive_path, backup_meta.archive_format), [
+                    "{}/level.dat".format(world_meta.name),
+                    "{}/region/r.0.0.mca".format(world_meta.name)])
+
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_backup_sharded_catalogs():
+    world_dir = _create_worlds("world", "world_nether")
+    target = BackupTarget(os.path.join(_tmp_dir, "backups"), parser.parse(["keep 7 days"]), shard_by_world=True,
+                          server_name="survival")
+
+    backup_to_targets(world_dir, [], [target], "{world}-{now:%H%M%S%f}.{ext}", 'tar|gz')
+    backup_to_targets(world_dir, ["world"], [target], "{world}-{now:%H%M%S%f}.{ext}", 'tar|gz')
+
+    eq_(meta.list_shards(target.backup_dir), ["survival.world", "survival.world_nether"])
+    eq_(len(meta.Catalog(target.backup_dir, "survival.world").load()), 2)
+    eq_(len(meta.Catalog(target.backup_dir, "survival.world_nether").load()), 1)
+    eq_(len(meta.load_meta(target.backup_dir)), 3)
+    # later runs only evaluate the new entries of a shard against the snapshot the policy left behind
+    with open(meta.Catalog(target.backup_dir, "survival.world").retention_path, 'r') as file:
+        eq_(file.read(), repr(target.retention_policy))
+
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_backup_segmented():
+    world_dir = _create_worlds("world")
+    _add_files(world_dir, "world", 10)
+    target = BackupTarget(os.path.join(_tmp_dir, "backups"), parser.parse(["keep 7 days"]))
+
+    backup_to_targets(world_dir, [], [target], "{world}.{ext}", 'tar|gz', segment_size=20 * 1024)
+
+    world_meta = meta.load_meta(target.backup_dir)[0].worlds[0]
+    eq_(world_meta.segments, ["world.part{:04d}.tar.gz".format(i) for i in range(1, 5)])
+    eq_(world_meta.path, world_meta.segments[0])
+    eq_(_read_segments(target.backup_dir, world_meta.segments, 'tar|gz'), _read_world(world_dir, "world"))
+    eq_(os.listdir(os.path.join(target.backup_dir, ".progress")), [])
+
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_backup_segmented_resume():
+    world_dir = _create_worlds("world")
+    _add_files(world_dir, "world", 10)
+    backup_dir = os.path.join(_tmp_dir, "backups")
+    progress_file = os.path.join(backup_dir, ".progress", "world.json")
+    archiver = DEFINITIONS['zip']
+
+    interrupted = CheckpointedWorldBackup(os.path.join(world_dir, "world"), archiver, backup_dir,
+                                          os.path.join(backup_dir, "first.zip"), progress_file, 20 * 1024,
+                                          _InterruptedReader(7))
+    try:
+        interrupted.run()
+        assert False, "expected the backup to be interrupted"
+    except OSError:
+        pass
+
+    completed = [segment['path'] for segment in interrupted.progress.segments]
+    eq_(completed, ["first.part0001.zip", "first.part0002.zip"])
+    first_segment_stat = os.stat(os.path.join(backup_dir, completed[0]))
+
+    # the rerun picks a new name but resumes into the files of the interrupted backup
+    resumed = CheckpointedWorldBackup(os.path.join(world_dir, "world"), archiver, backup_dir,
+                                      os.path.join(backup_dir, "second.zip"), progress_file, 20 * 1024)
+    segments = resumed.run()
+
+    eq_(segments[:2], completed)
+    eq_(len(segments), 4)
+    eq_(os.stat(os.path.join(backup_dir, completed[0])).st_mtime_ns, first_segment_stat.st_mtime_ns)
+    eq_(_read_segments(backup_dir, segments, 'zip'), _read_world(world_dir, "world"))
+    assert not os.path.exists(progress_file)
+
+@raises(BackupError)
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_backup_fan_out_isolates_failed_target():
+    world_dir = _create_worlds("world")
+    healthy = BackupTarget(os.path.join(_tmp_dir, "primary"), parser.parse(["keep 7 days"]))
+    full = BackupTarget(os.path.join(_tmp_dir, "full"), parser.parse(["keep 7 days"]))
+
+    # a plain file where the backup directory should be makes every write to the target fail
+    with open(full.backup_dir, 'w'):
+        pass
+
+    try:
+        backup_to_targets(world_dir, [], [healthy, full], "{world}.{ext}", 'tar|gz')
+    finally:
+        eq_([world.name for world in meta.load_meta(healthy.backup_dir)[0].worlds], ["world"])
+        assert full.error is not None
+
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_backup_world_read_error():
+    for backup_dirs in [["primary"], ["primary", "mirror"]]:
+        yield _run_backup_world_read_error, backup_dirs
+
+def _run_backup_world_read_error(backup_dirs):
+    world_dir = _create_worlds("broken", "world")
+    # like a file the server deletes while the backup walks the world
+    os.symlink(os.path.join(world_dir, "missing"), os.path.join(world_dir, "broken", "region", "r.1.0.mca"))
+
+    targets = [BackupTarget(os.path.join(_tmp_dir, backup_dir), parser.parse(["keep 7 days"]))
+               for backup_dir in backup_dirs]
+    try:
+        backup_to_targets(world_dir, ["broken", "world"], targets, "{world}.{ext}", 'tar|gz')
+        assert False, "expected the backup to report the broken world"
+    except BackupError as e:
+        assert "broken" in str(e)
+    finally:
+        shutil.rmtree(world_dir)
+
+    for target in targets:
+        eq_(target.error, None)
+        eq_([world.name for world in meta.load_meta(target.backup_dir)[0].worlds], ["world"])
+        assert not os.path.exists(os.path.join(target.backup_dir, "broken.tar.gz"))
+        shutil.rmtree(target.backup_dir)
+
+class _InterruptedReader(PipelinedReader):
+    def __init__(self, fail_after):
+        super(_InterruptedReader, self).__init__()
+        self.fail_after = fail_after
+
+    def read(self, files):
+        for (i, file_data) in enumerate(super(_InterruptedReader, self).read(files)):
+            if i == self.fail_after:
+                raise OSError("Killed")
+            yield file_data
+
+class _Destination(object):
+    def __init__(self, fail_after=None, hang_after=None):
+        self.buffer = io.BytesIO()
+        self.fail_after = fail_after
+        self.hang_after = hang_after
+        self.release = threading.Event()
+        self.writes = 0
+        self.contents = None
+
+    def write(self, data):
+        self.writes += 1
+        if self.hang_after is not None and self.writes > self.hang_after:
+            # like a write to a dead network mount, it only returns once the test is over
+            self.release.wait()
+        if self.fail_after is not None and self.writes > self.fail_after:
+            raise IOError("No space left on device")
+        self.buffer.write(data)
+
+    def close(self):
+        self.contents = self.buffer.getvalue()
+
+def _create_worlds(*worlds):
+    world_dir = os.path.join(_tmp_dir, "worlds")
+    for world in worlds:
+        os.makedirs(os.path.join(world_dir, world, "region"))
+        with open(os.path.join(world_dir, world, "level.dat"), 'wb') as file:
+            file.write(os.urandom(1024))
+        with open(os.path.join(world_dir, world, "region", "r.0.0.mca"), 'wb') as file:
+            file.write(os.urandom(64 * 1024))
+
+    return world_dir
+
+def _add_files(world_dir, world, count):
+    os.makedirs(os.path.join(world_dir, world, "playerdata"))
+    for i in range(count):
+        with open(os.path.join(world_dir, world, "playerdata", "player{}.dat".format(i)), 'wb') as file:
+            file.write(os.urandom(8 * 1024))
+
+def _read_segments(backup_dir, segments, archive_format):
+    contents = {}
+    for segment in segments:
+        segment_contents = _read_archive(os.path.join(backup_dir, segment), archive_format)
+        eq_(set(contents.keys()) & set(segment_contents.keys()), set())
+        contents.update(segment_contents)
+    return contents
+
+def _read_world(world_dir, world):
+    contents = {}
+    for (dirpath, _, files) in os.walk(os.path.join(world_dir, world)):
+        for file in files:
+            with open(os.path.join(dirpath, file), 'rb') as handle:
+                contents[os.path.relpath(os.path.join(dirpath, file), world_dir)] = handle.read()
+    return contents
+
+def _read_archive(archive_path, archive_format):
+    if archive_format.startswith('zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            return {name : archive.read(name) for name in archive.namelist()}
+
+    with tarfile.open(archive_path) as archive:
+        return {member.name : archive.extractfile(member).read() for member in archive.getmembers()}
+
+def _list_archive(archive_path, archive_format):
+    if archive_format.startswith('zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            return sorted(archive.namelist())
+
+    with tarfile.open(archive_path) as archive:
+        return sorted(archive.getnames())
@@ -0,0 +1,11 @@
+from nose.tools import eq_
+
+from .context import mcbackup
+from benchmarks.bench_import import ENTRY_POINTS, forbidden_imports, imported_modules
+
+def test_entry_points_import_lazily():
+    for name in sorted(ENTRY_POINTS.keys()):
+        yield _run_entry_point_imports, name
+
+def _run_entry_point_imports(name):
+    eq_(forbidden_imports(name, imported_modules(name)), [])
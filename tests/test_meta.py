@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+import datetime
+import multiprocessing
+from dateutil.tz import tzutc
+from nose.tools import eq_, raises, with_setup
+
+from .context import mcbackup
+from mcbackup import meta
+
+_backup_dir = None
+
+def _setup_backup_dir():
+    global _backup_dir
+    _backup_dir = tempfile.mkdtemp()
+
+def _teardown_backup_dir():
+    shutil.rmtree(_backup_dir)
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_save_and_load_meta():
+    backups = [_create_backup("backup1", "world"), _create_backup("backup2", "world", tag=meta.TAG_DAILY)]
+    meta.save_meta(_backup_dir, backups)
+
+    loaded = meta.load_meta(_backup_dir)
+    eq_(loaded, backups)
+    eq_([backup.tag for backup in loaded], [meta.TAG_SNAPSHOT, meta.TAG_DAILY])
+    eq_([backup.time for backup in loaded], [backup.time for backup in backups])
+    eq_([backup.worlds[0].path for backup in loaded], ["world/backup1.tar.gz", "world/backup2.tar.gz"])
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_catalog_journal_and_transaction():
+    catalog = meta.Catalog(_backup_dir, "world")
+    catalog.append(_create_backup("backup1", "world"))
+    catalog.append(_create_backup("backup2", "world"))
+    eq_([backup.id for backup in catalog.load()], ["backup1", "backup2"])
+
+    with catalog.transaction() as transaction:
+        transaction.backups = transaction.backups[1:]
+
+    eq_(os.path.getsize(catalog.journal_path), 0)
+    eq_([backup.id for backup in catalog.load()], ["backup2"])
+    eq_(meta.list_shards(_backup_dir), ["world"])
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_catalog_ignores_partial_and_duplicate_journal_entries():
+    catalog = meta.Catalog(_backup_dir, "world")
+    with catalog.transaction() as transaction:
+        transaction.backups = [_create_backup("backup1", "world")]
+
+    # what a crash between rewriting the snapshot and truncating the journal, or mid append, leaves behind
+    with open(catalog.journal_path, 'w') as file:
+        file.write(meta.MetaDataJSONEncoder().encode(_create_backup("backup1", "world")) + "\n")
+        file.write(meta.MetaDataJSONEncoder().encode(_create_backup("backup2", "world")) + "\n")
+        file.write('{"__type__": "mcbackup.meta.BackupMeta", "id": "bac')
+
+    eq_([backup.id for backup in catalog.load()], ["backup1", "backup2"])
+
+    # the same crash after the retention policy split an entry into one piece per world
+    with catalog.transaction() as transaction:
+        transaction.backups = [meta.BackupMeta("backup1/world", transaction.backups[0].time, 'tar|gz',
+                                               transaction.backups[0].worlds, parent_id="backup1")]
+    with open(catalog.journal_path, 'w') as file:
+        file.write(meta.MetaDataJSONEncoder().encode(_create_backup("backup1", "world")) + "\n")
+
+    eq_([backup.id for backup in catalog.load()], ["backup1/world"])
+    eq_(catalog.load()[0].parent_id, "backup1")
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_catalog_transaction_retention():
+    catalog = meta.Catalog(_backup_dir, "world")
+    catalog.append(_create_backup("backup1", "world"))
+    with catalog.transaction() as transaction:
+        eq_([backup.id for backup in transaction.appended], ["backup1"])
+        eq_(transaction.stored_retention, None)
+        transaction.retention = "policy"
+
+    catalog.append(_create_backup("backup2", "world"))
+    with catalog.transaction() as transaction:
+        eq_([backup.id for backup in transaction.backups], ["backup1", "backup2"])
+        eq_([backup.id for backup in transaction.appended], ["backup2"])
+        eq_(transaction.stored_retention, "policy")
+        transaction.retention = "policy"
+
+    # rewriting the entries without applying the policy forgets which policy produced them
+    meta.save_meta(_backup_dir, [])
+    with meta.Catalog(_backup_dir).transaction() as transaction:
+        eq_(transaction.stored_retention, None)
+    with catalog.transaction() as transaction:
+        eq_(transaction.stored_retention, "policy")
+        transaction.backups = transaction.backups[1:]
+    with catalog.transaction() as transaction:
+        eq_(transaction.stored_retention, None)
+
+    assert not os.path.exists(catalog.retention_path)
+
+@raises(meta.CatalogBusyError)
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_catalog_busy():
+    catalog = meta.Catalog(_backup_dir, "world")
+    with catalog.transaction():
+        with meta.Catalog(_backup_dir, "world").transaction(blocking=False):
+            pass
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_load_meta_does_not_write():
+    missing_dir = os.path.join(_backup_dir, "missing")
+    eq_(meta.load_meta(missing_dir), [])
+    assert not os.path.exists(missing_dir)
+
+    # a catalog copied without its lock file, or on a mount the reader cannot write to
+    catalog = meta.Catalog(_backup_dir, "world")
+    catalog.append(_create_backup("backup1", "world"))
+    os.unlink(catalog.lock_path)
+
+    eq_([backup.id for backup in meta.load_meta(_backup_dir)], ["backup1"])
+    assert not os.path.exists(catalog.lock_path)
+    assert not os.path.exists(meta.Catalog(_backup_dir).lock_path)
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_catalog_shards_lock_independently():
+    with meta.Catalog(_backup_dir, "world").transaction():
+        with meta.Catalog(_backup_dir, "world_nether").transaction(blocking=False) as transaction:
+            transaction.backups = [_create_backup("backup1", "world_nether")]
+
+    eq_([backup.id for backup in meta.load_meta(_backup_dir)], ["backup1"])
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_concurrent_writers():
+    processes = [multiprocessing.Process(target=_write_backups, args=(_backup_dir, shard, writer))
+                 for shard in ["world", "world_nether"] for writer in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        eq_(process.exitcode, 0)
+
+    eq_(sorted(backup.id for backup in meta.load_meta(_backup_dir)),
+        sorted("{}-{}-{}".format(shard, writer, i) for shard in ["world", "world_nether"]
+               for writer in range(4) for i in range(25)))
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_migrate_to_shards():
+    backup = meta.BackupMeta("backup1", archive_format='tar|gz', tag=meta.TAG_WEEKLY,
+                             worlds=[meta.WorldMeta("world", "world.tar.gz"),
+                                     meta.WorldMeta("world_nether", "world_nether.tar.gz")])
+    meta.save_meta(_backup_dir, [backup])
+
+    meta.migrate_to_shards(_backup_dir, lambda world: world)
+
+    eq_(meta.Catalog(_backup_dir).load(), [])
+    eq_(meta.list_shards(_backup_dir), ["world", "world_nether"])
+    for world in ["world", "world_nether"]:
+        migrated = meta.Catalog(_backup_dir, world).load()
+        eq_([(backup.id, backup.tag) for backup in migrated], [("backup1", meta.TAG_WEEKLY)])
+        eq_([world_meta.name for world_meta in migrated[0].worlds], [world])
+
+def _write_backups(backup_dir, shard, writer):
+    catalog = meta.Catalog(backup_dir, shard)
+    for i in range(25):
+        catalog.append(_create_backup("{}-{}-{}".format(shard, writer, i), shard))
+
+        # keep rewriting the snapshot while the other writers append
+        if i % 5 == 0:
+            with catalog.transaction() as transaction:
+                transaction.backups = list(transaction.backups)
+
+def _create_backup(backup_id, world, tag=meta.TAG_SNAPSHOT):
+    return meta.BackupMeta(backup_id, datetime.datetime(2024, 1, 1, tzinfo=tzutc()), archive_format='tar|gz',
+                           worlds=[meta.WorldMeta(world, "{}/{}.tar.gz".format(world, backup_id))], tag=tag)
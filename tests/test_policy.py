@@ -6,7 +6,8 @@ from nose.tools import eq_, raises, assert_not_equal
 
 from .context import mcbackup
 from mcbackup import meta
-from mcbackup.policy import RetentionPolicy, RetentionRule, Duration, DurationForever, parser, tagger
+from mcbackup.policy import RetentionPolicy, WorldRetentionPolicy, RetentionRule, Duration, DurationForever, parser, \
+    tagger
 
 def test_durations_equals():
     eq_(Duration(relativedelta(days=7)), Duration(relativedelta(days=7)))
@@ -150,6 +151,89 @@ def test_policy_apply():
                                 backups["monthly2"],
                                 backups["yearly1"]])
 
+def test_parse_worlds():
+    policy = parser.parse_worlds(["keep 7 days"], [["creative_*", "keep 1 day", "latest daily keep 1 month"]])
+
+    eq_(policy, WorldRetentionPolicy(parser.parse(["keep 7 days"]),
+                                     [("creative_*", parser.parse(["keep 1 day", "latest daily keep 1 month"]))]))
+    eq_(policy.policy_for("creative_build"), parser.parse(["keep 1 day", "latest daily keep 1 month"]))
+    eq_(policy.policy_for("survival"), parser.parse(["keep 7 days"]))
+    eq_(parser.parse_worlds(["keep 7 days"], []), parser.parse(["keep 7 days"]))
+
+def test_policy_apply_incremental():
+    policies = [["keep 7 days", "latest weekly keep 1 month", "latest monthly keep 6 months"],
+                ["keep 2 hours", "latest hourly keep 1 day", "oldest daily keep 1 week", "latest weekly keep 5 weeks",
+                 "oldest monthly keep 1 year", "latest yearly keep forever"]]
+    for rules in policies:
+        # irregular gaps exercise buckets that receive several backups, one backup or none at all
+        yield _run_policy_apply_incremental, parser.parse(rules), datetime.datetime(2023, 12, 20, tzinfo=tzutc()), \
+            [7, 45, 90, 300], 3000
+
+    # adding months clamps to the end of the month, so Jan 31 expires before Jan 30 23:00 does
+    yield _run_policy_apply_incremental, parser.parse(["keep 1 month"]), \
+        datetime.datetime(2024, 1, 25, tzinfo=tzutc()), [60], 1000
+    yield _run_policy_apply_incremental, parser.parse(["keep 2 days", "latest hourly keep 1 month",
+                                                       "latest daily keep 1 year"]), \
+        datetime.datetime(2024, 1, 25, tzinfo=tzutc()), [30], 2000
+
+def _run_policy_apply_incremental(policy, now, gaps, count):
+    backups = []
+    for i in range(count):
+        now += relativedelta(minutes=gaps[i % len(gaps)])
+        new_backups = [meta.BackupMeta(time=now)]
+
+        (keep, purge) = policy.apply(backups + new_backups, now)
+        (incremental_keep, incremental_purge) = policy.apply_incremental(backups + new_backups, new_backups, now)
+
+        eq_(sorted((backup.id, backup.tag) for backup in incremental_keep),
+            sorted((backup.id, backup.tag) for backup in keep))
+        eq_(sorted(backup.id for backup in incremental_purge), sorted(backup.id for backup in purge))
+        backups = keep
+
+def test_world_policy_apply():
+    now = datetime.datetime(2024, 1, 10, 12, tzinfo=tzutc())
+    policy = WorldRetentionPolicy(parser.parse(["keep 2 hours", "latest hourly keep 1 day"]),
+                                  [("creative_*", parser.parse(["keep 2 hours", "latest daily keep 1 week"]))])
+
+    backups = [meta.BackupMeta("backup{}".format(i), now - relativedelta(minutes=30 * i), 'tar|gz',
+                               [meta.WorldMeta("survival", "survival{}.tar.gz".format(i)),
+                                meta.WorldMeta("creative_build", "creative_build{}.tar.gz".format(i))])
+               for i in range(12)]
+
+    (keep, purge) = policy.apply(backups, now)
+
+    # every backup is split into one entry per world, and each world keeps what its own policy asks for
+    kept_by_world = {}
+    for backup in keep:
+        eq_(len(backup.worlds), 1)
+        kept_by_world.setdefault(backup.worlds[0].name, []).append((backup.parent_id, backup.tag))
+    eq_(sorted(kept_by_world["survival"]), [("backup0", meta.TAG_SNAPSHOT), ("backup1", meta.TAG_SNAPSHOT),
+                                            ("backup11", meta.TAG_HOURLY), ("backup2", meta.TAG_SNAPSHOT),
+                                            ("backup3", meta.TAG_SNAPSHOT), ("backup4", meta.TAG_SNAPSHOT),
+                                            ("backup5", meta.TAG_HOURLY), ("backup7", meta.TAG_HOURLY),
+                                            ("backup9", meta.TAG_HOURLY)])
+    # the latest backup of the day is still a snapshot, so none of the expired ones becomes the daily
+    eq_(sorted(kept_by_world["creative_build"]), [("backup0", meta.TAG_SNAPSHOT), ("backup1", meta.TAG_SNAPSHOT),
+                                                  ("backup2", meta.TAG_SNAPSHOT), ("backup3", meta.TAG_SNAPSHOT),
+                                                  ("backup4", meta.TAG_SNAPSHOT)])
+    eq_(sorted((backup.parent_id, backup.worlds[0].name) for backup in purge),
+        sorted([("backup{}".format(i), "survival") for i in [6, 8, 10]] +
+               [("backup{}".format(i), "creative_build") for i in range(5, 12)]))
+    eq_(sorted(backup.id for backup in keep + purge),
+        sorted("backup{}/{}".format(i, world) for i in range(12) for world in ["creative_build", "survival"]))
+
+    # the same policy leaves the pieces alone, a single policy merges them back and keeps or purges every world
+    eq_(policy.apply(keep, now), (keep, []))
+
+    (keep_all, purge_all) = parser.parse(["keep 1 hour"]).apply(keep, now)
+    eq_(sorted(world.path for backup in keep_all for world in backup.worlds),
+        sorted(["creative_build{}.tar.gz".format(i) for i in range(3)] +
+               ["survival{}.tar.gz".format(i) for i in [0, 1, 2, 5, 7, 9, 11]]))
+    eq_(sorted(world.path for backup in purge_all for world in backup.worlds),
+        ["creative_build3.tar.gz", "creative_build4.tar.gz", "survival3.tar.gz", "survival4.tar.gz"])
+    eq_(sorted(backup.id for backup in keep_all if len(backup.worlds) == 2),
+        ["backup0/creative_build", "backup1/creative_build", "backup2/creative_build"])
+
 def create_backup(dictionary, backup_id, time, tag):
     dictionary[backup_id] = meta.BackupMeta(backup_id, time, archive_format='tar|gz', tag=tag)
 
@@ -0,0 +1,207 @@
+import os
+import socket
+import shutil
+import tempfile
+from unittest import SkipTest
+from nose.tools import eq_, raises, with_setup
+
+from .context import mcbackup
+from mcbackup import meta
+from mcbackup.replication import S3Replicator, ReplicationError, ReplicationState, MIN_PART_SIZE, MAX_PARTS, \
+    parse_s3_url
+
+try:
+    import boto3
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    boto3 = None
+
+BUCKET = 'backups'
+
+_server = None
+_endpoint_url = None
+_backup_dir = None
+
+def setup_module():
+    global _server, _endpoint_url
+
+    if boto3 is None:
+        raise SkipTest("boto3 and moto are required for the replication tests")
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    port = _free_port()
+    _server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    _server.start()
+    _endpoint_url = "http://127.0.0.1:{}".format(port)
+
+def teardown_module():
+    if _server is not None:
+        _server.stop()
+
+def _setup_backup_dir():
+    global _backup_dir
+
+    _backup_dir = tempfile.mkdtemp()
+    client = _client()
+    client.create_bucket(Bucket=BUCKET)
+
+def _teardown_backup_dir():
+    shutil.rmtree(_backup_dir)
+
+    client = _client()
+    for obj in client.list_objects_v2(Bucket=BUCKET).get('Contents', []):
+        client.delete_object(Bucket=BUCKET, Key=obj['Key'])
+    for upload in client.list_multipart_uploads(Bucket=BUCKET).get('Uploads', []):
+        client.abort_multipart_upload(Bucket=BUCKET, Key=upload['Key'], UploadId=upload['UploadId'])
+    client.delete_bucket(Bucket=BUCKET)
+
+def test_parse_s3_url():
+    eq_(parse_s3_url("s3://bucket"), ("bucket", ""))
+    eq_(parse_s3_url("s3://bucket/some/prefix/"), ("bucket", "some/prefix"))
+
+@raises(ValueError)
+def test_parse_s3_url_invalid():
+    parse_s3_url("/var/backups")
+
+def test_part_size_for():
+    replicator = S3Replicator(BUCKET, client=object())
+    mebibyte = 1024 * 1024
+
+    eq_(replicator.part_size_for(100 * mebibyte), replicator.part_size)
+    eq_(replicator.part_size_for(replicator.part_size * MAX_PARTS), replicator.part_size)
+    # a 100GiB world would need 12800 parts of 8MiB
+    part_size = replicator.part_size_for(100 * 1024 * mebibyte)
+    eq_(part_size % mebibyte, 0)
+    assert (100 * 1024 * mebibyte + part_size - 1) // part_size <= MAX_PARTS
+    eq_(part_size, 11 * mebibyte)
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_replicate_uploads_archives_and_catalog():
+    small = _create_archive("20240101/world-000000.tar.gz", 1024)
+    large = _create_archive("20240101/nether-000000.tar.gz", 2 * MIN_PART_SIZE + 1024)
+    meta_data = [_create_backup("backup1", small, large)]
+    meta.save_meta(_backup_dir, meta_data)
+
+    _replicator().replicate(_backup_dir, meta_data)
+
+    eq_(_remote_objects(), {"mc/20240101/world-000000.tar.gz" : small[1],
+                            "mc/20240101/nether-000000.tar.gz" : large[1],
+                            "mc/meta.json" : _read(os.path.join(_backup_dir, "meta.json"))})
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_replicate_skips_unchanged_archives():
+    archive = _create_archive("20240101/world-000000.tar.gz", 1024)
+    meta_data = [_create_backup("backup1", archive)]
+
+    _replicator().replicate(_backup_dir, meta_data)
+
+    client = _CountingClient(_client())
+    _replicator(client).replicate(_backup_dir, meta_data)
+    eq_(client.calls.get('put_object', 0), 0)
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_replicate_mirrors_purges():
+    first = _create_archive("20240101/world-000000.tar.gz", 1024)
+    second = _create_archive("20240102/world-000000.tar.gz", 1024)
+
+    _replicator().replicate(_backup_dir, [_create_backup("backup1", first), _create_backup("backup2", second)])
+    _replicator().replicate(_backup_dir, [_create_backup("backup2", second)])
+
+    eq_(sorted(_remote_objects().keys()), ["mc/20240102/world-000000.tar.gz"])
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_replicate_resumes_interrupted_multipart_upload():
+    archive = _create_archive("20240101/world-000000.tar.gz", 3 * MIN_PART_SIZE + 1024)
+    meta_data = [_create_backup("backup1", archive)]
+
+    failing_client = _CountingClient(_client(), fail_after_parts=2)
+    try:
+        _replicator(failing_client, max_workers=1).replicate(_backup_dir, meta_data)
+        assert False, "expected the interrupted replication to fail"
+    except ReplicationError:
+        pass
+
+    client = _CountingClient(_client())
+    _replicator(client).replicate(_backup_dir, meta_data)
+
+    eq_(client.calls.get('create_multipart_upload', 0), 0)
+    eq_(client.calls['upload_part'], 2)
+    eq_(_remote_objects()["mc/20240101/world-000000.tar.gz"], archive[1])
+
+@with_setup(_setup_backup_dir, _teardown_backup_dir)
+def test_replication_state_merges_concurrent_runs():
+    first = _create_archive("20240101/world-000000.tar.gz", 1024)
+    second = _create_archive("20240102/world-000000.tar.gz", 1024)
+    third = _create_archive("20240103/world-000000.tar.gz", 1024)
+
+    ReplicationState.load(_backup_dir, "dest").uploaded(first[0], os.stat(os.path.join(_backup_dir, first[0])))
+
+    # two runs that loaded the same state neither lose each other's uploads nor bring back a purged one
+    run1 = ReplicationState.load(_backup_dir, "dest")
+    run2 = ReplicationState.load(_backup_dir, "dest")
+    run1.uploaded(second[0], os.stat(os.path.join(_backup_dir, second[0])))
+    run1.forget(first[0])
+    run2.uploaded(third[0], os.stat(os.path.join(_backup_dir, third[0])))
+
+    eq_(ReplicationState.load(_backup_dir, "dest").remote_paths(), {second[0], third[0]})
+    eq_([name for name in os.listdir(_backup_dir) if name.endswith(".tmp")], [])
+
+class _CountingClient(object):
+    def __init__(self, client, fail_after_parts=None):
+        self.client = client
+        self.fail_after_parts = fail_after_parts
+        self.calls = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if name == 'upload_part' and self.fail_after_parts is not None and \
+                    self.calls[name] > self.fail_after_parts:
+                raise IOError("simulated connection failure")
+            return attr(*args, **kwargs)
+
+        return call
+
+def _replicator(client=None, max_workers=4):
+    return S3Replicator(BUCKET, "mc", endpoint_url=_endpoint_url, part_size=MIN_PART_SIZE,
+                        max_workers=max_workers, client=client if client else _client())
+
+def _client():
+    return boto3.client('s3', endpoint_url=_endpoint_url)
+
+def _remote_objects():
+    client = _client()
+    objects = {}
+    for obj in client.list_objects_v2(Bucket=BUCKET).get('Contents', []):
+        objects[obj['Key']] = client.get_object(Bucket=BUCKET, Key=obj['Key'])['Body'].read()
+    return objects
+
+def _create_archive(path, size):
+    full_path = os.path.join(_backup_dir, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+    data = os.urandom(size)
+    with open(full_path, 'wb') as file:
+        file.write(data)
+
+    return (path, data)
+
+def _create_backup(backup_id, *archives):
+    worlds = [meta.WorldMeta(os.path.basename(path).split('-')[0], path) for (path, _) in archives]
+    return meta.BackupMeta(backup_id, archive_format='tar|gz', worlds=worlds)
+
+def _read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
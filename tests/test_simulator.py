@@ -0,0 +1,66 @@
+import datetime
+import collections
+from unittest import SkipTest
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import tzutc
+from nose.tools import eq_, raises
+
+from .context import mcbackup
+from mcbackup import meta
+from mcbackup.policy import parser
+
+try:
+    from mcbackup.policy.simulator import Timeline, simulate
+except ImportError:
+    simulate = None
+
+def setup_module():
+    if simulate is None:
+        raise SkipTest("numpy is required for the retention simulator tests")
+
+def test_simulate_matches_policy_apply():
+    test_data = [(["keep 1 day", "latest daily keep 7 days", "latest weekly keep 1 month"],
+                  relativedelta(hours=1), 60),
+                 (["keep 2 hours", "oldest hourly keep 1 day", "oldest daily keep 2 weeks", "latest yearly keep forever"],
+                  relativedelta(minutes=20), 20),
+                 (["keep 10 minutes", "latest hourly keep 30 minutes", "latest monthly keep 1 month"],
+                  relativedelta(minutes=30), 70),
+                 (["latest daily keep 1 day"], relativedelta(hours=1), 3),
+                 (["keep 2 hours", "oldest monthly keep 6 weeks"], relativedelta(hours=1), 70)]
+
+    for (rules, interval, days) in test_data:
+        yield _run_simulate_matches_policy_apply, rules, interval, days
+
+def _run_simulate_matches_policy_apply(rules, interval, days):
+    policy = parser.parse(rules)
+    start = datetime.datetime(2023, 12, 27, 5, 17, tzinfo=tzutc())
+    timeline = Timeline.synthetic(start, start + relativedelta(days=days), interval, 100)
+    result = simulate(policy, timeline)
+
+    # replay the real policy one backup at a time and compare the retained backups after every run
+    backups = []
+    for (i, backup_time) in enumerate(timeline.times.astype(datetime.datetime)):
+        now = backup_time.replace(tzinfo=tzutc())
+        backups.append(meta.BackupMeta(str(i), now, archive_format='tar|gz'))
+        (backups, _) = policy.apply(backups, now)
+
+        tags = collections.Counter(backup.tag for backup in backups)
+        eq_({tag : int(counts[i]) for (tag, counts) in result.counts.items()},
+            {tag : tags[tag] for tag in result.counts})
+        eq_(result.total_count[i], len(backups))
+        eq_(result.total_bytes[i], 100 * len(backups))
+
+def test_simulate_growth_and_samples():
+    start = datetime.datetime(2024, 1, 1, tzinfo=tzutc())
+    timeline = Timeline.synthetic(start, start + relativedelta(days=10), relativedelta(days=1), 1000, growth=10)
+    result = simulate(parser.parse(["keep forever"]), timeline, timeline.times[[0, 4, 9]])
+
+    eq_(list(result.total_count), [1, 5, 10])
+    eq_(list(result.total_bytes), [1000, 5 * 1000 + 10 * (0 + 1 + 2 + 3 + 4), 10 * 1000 + 10 * 45])
+
+@raises(ValueError)
+def test_simulate_rejects_reelection():
+    # the monthly backup is purged after a week, then apply() elects the oldest backup of the month still around
+    start = datetime.datetime(2024, 1, 1, tzinfo=tzutc())
+    timeline = Timeline.synthetic(start, start + relativedelta(days=20), relativedelta(hours=1), 100)
+    simulate(parser.parse(["keep 2 hours", "oldest monthly keep 1 week"]), timeline)
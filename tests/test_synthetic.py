@@ -0,0 +1,70 @@
+import os
+import gzip
+import random
+import zlib
+import struct
+import shutil
+import tempfile
+from nose.tools import eq_, with_setup
+
+from .context import mcbackup
+from benchmarks.synthetic import create_world, create_catalog, _section_patterns, _PALETTE_SIZE, _BITS_PER_BLOCK
+
+_tmp_dir = None
+
+def _setup_tmp_dir():
+    global _tmp_dir
+    _tmp_dir = tempfile.mkdtemp()
+
+def _teardown_tmp_dir():
+    shutil.rmtree(_tmp_dir)
+
+@with_setup(_setup_tmp_dir, _teardown_tmp_dir)
+def test_create_world():
+    world_path = os.path.join(_tmp_dir, "world")
+    written = create_world(world_path, regions=2, chunks=100, fill=0.25, players=5)
+
+    eq_(sorted(os.listdir(os.path.join(world_path, "region"))), ["r.-1.-1.mca", "r.0.-1.mca"])
+    eq_(len(os.listdir(os.path.join(world_path, "playerdata"))), 5)
+    eq_(len(os.listdir(os.path.join(world_path, "stats"))), 5)
+    eq_(sum(os.path.getsize(os.path.join(dirpath, file)) for (dirpath, _, files) in os.walk(world_path)
+            for file in files), written)
+
+    # level.dat is a gzipped NBT compound
+    with open(os.path.join(world_path, "level.dat"), 'rb') as file:
+        eq_(gzip.decompress(file.read())[:3], b"\x0a\x00\x00")
+
+    with open(os.path.join(world_path, "region", "r.0.-1.mca"), 'rb') as file:
+        region = file.read()
+
+    eq_(len(region) % 4096, 0)
+    chunks = 0
+    for index in range(1024):
+        (location,) = struct.unpack_from('>I', region, index * 4)
+        if not location:
+            continue
+
+        (offset, sectors) = (location >> 8, location & 0xff)
+        (length, compression) = struct.unpack_from('>ib', region, offset * 4096)
+        assert length + 4 <= sectors * 4096
+        eq_(compression, 2)
+        eq_(zlib.decompress(region[offset * 4096 + 5:offset * 4096 + 4 + length])[:3], b"\x0a\x00\x00")
+        chunks += 1
+
+    eq_(chunks, 100)
+
+def test_section_patterns_index_the_palette():
+    mask = (1 << _BITS_PER_BLOCK) - 1
+    for pattern in _section_patterns(random.Random(0)):
+        assert -(1 << 63) <= pattern < (1 << 63)
+        unsigned = pattern & ((1 << 64) - 1)
+        for shift in range(0, 64, _BITS_PER_BLOCK):
+            assert (unsigned >> shift) & mask < _PALETTE_SIZE
+
+def test_create_catalog():
+    backups = create_catalog(10, worlds=["world"])
+
+    eq_(len(backups), 10)
+    eq_(len(set(backup.id for backup in backups)), 10)
+    eq_(sorted(backups, key=lambda backup: backup.time), backups)
+    eq_([len(backup.worlds) for backup in backups], [1] * 10)